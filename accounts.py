@@ -0,0 +1,294 @@
+# -*- coding:utf-8 -*-
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import codec
+from cookie import AuthRejected, SunoCookie, TokenManager
+from resilience import QueueFull, UpstreamError
+from tokenstore import get_store
+from tracing import get_logger
+from utils import generate_lyrics, generate_music, get_credits
+
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE")
+GENERATION_COST = int(os.getenv("GENERATION_COST", "10"))
+CREDITS_REFRESH_INTERVAL = float(os.getenv("CREDITS_REFRESH_INTERVAL", "300"))
+ACCOUNT_EJECT_TIME = float(os.getenv("ACCOUNT_EJECT_TIME", "60"))
+ACCOUNT_AUTH_EJECT_TIME = float(os.getenv("ACCOUNT_AUTH_EJECT_TIME", "300"))
+OWNERS_MAX = int(os.getenv("OWNERS_MAX", "100000"))
+
+log = get_logger("accounts")
+
+
+class AccountUnavailable(UpstreamError):
+    def __init__(self, detail, retry_after=None, rejected=False):
+        super().__init__(503, detail, retry_after)
+        # True when Clerk refused the session, False when it was only unreachable or failing
+        self.rejected = rejected
+
+
+class Account:
+    """One Suno session with its own token lifecycle, credit balance and load."""
+
+    def __init__(self, name, session_id, cookie, store=None):
+        suno_cookie = SunoCookie()
+        suno_cookie.set_session_id(session_id)
+        suno_cookie.load_cookie(cookie or "")
+        self.name = name
+        self.tokens = TokenManager(suno_cookie, store=store)
+        self.credits = None
+        self.credits_checked = None
+        self.in_flight = 0
+        self.ejected_until = 0.0
+        # the last tokens handed out, so a 401 on one can be traced back to this account
+        self.issued = deque(maxlen=2)
+        self._credits_refresh = None
+
+    @property
+    def ejected(self):
+        return time.monotonic() < self.ejected_until
+
+    def eject(self, seconds, reason):
+        self.ejected_until = time.monotonic() + seconds
+        log.warning("account_ejected", account=self.name, seconds=seconds, reason=reason)
+
+    async def get_token(self):
+        return await self._authenticate(self.tokens.get_token())
+
+    async def refresh_token(self, stale_token):
+        return await self._authenticate(self.tokens.refresh(stale_token))
+
+    async def _authenticate(self, pending):
+        # the pool decides about ejection; a failed refresh is simply tried again by the next call
+        try:
+            token = await pending
+        except AuthRejected as e:
+            raise AccountUnavailable(f"account {self.name} was signed out: {e}", rejected=True)
+        except Exception as e:
+            log.warning("token_refresh_failed", account=self.name, error=str(e))
+            raise AccountUnavailable(f"account {self.name} cannot refresh its token: {e}")
+        if token not in self.issued:
+            self.issued.append(token)
+        return token
+
+    async def refresh_credits(self):
+        try:
+            info = await get_credits(await self.get_token())
+            self.credits = info.get("total_credits_left")
+        except UpstreamError as e:
+            log.warning("credits_check_failed", account=self.name, detail=e.detail)
+        finally:
+            self.credits_checked = time.monotonic()
+            self._credits_refresh = None
+
+
+class AccountPool:
+    """Spreads work across accounts and remembers which account owns each clip.
+
+    With a `store`, clip owners are shared with the other workers, so a clip
+    generated through one worker can be looked up through any of them.
+    """
+
+    def __init__(self, accounts, store=None):
+        if not accounts:
+            raise ValueError("at least one account is required")
+        self.accounts = accounts
+        self.by_name = {account.name: account for account in accounts}
+        self.owners = OrderedDict()
+        # with a single account every clip belongs to it, so there is nothing to share
+        self.store = store if len(accounts) > 1 else None
+
+    @property
+    def primary(self):
+        return self.accounts[0]
+
+    def _refresh_stale_credits(self):
+        now = time.monotonic()
+        for account in self.accounts:
+            stale = (
+                account.credits_checked is None
+                or now - account.credits_checked >= CREDITS_REFRESH_INTERVAL
+            )
+            if stale and account._credits_refresh is None and not account.ejected:
+                account._credits_refresh = asyncio.ensure_future(account.refresh_credits())
+
+    def pick(self, exclude=(), cost=0):
+        """The account with the most credits per request in flight, skipping ejected ones."""
+        self._refresh_stale_credits()
+        candidates = [
+            account
+            for account in self.accounts
+            if not account.ejected
+            and account.name not in exclude
+            and (account.credits is None or account.credits >= cost)
+        ]
+        if not candidates:
+            waits = [a.ejected_until - time.monotonic() for a in self.accounts if a.ejected]
+            raise AccountUnavailable(
+                "no Suno account is available", max(1, int(min(waits))) if waits else None
+            )
+        # an account whose balance is not known yet is assumed to be as well off as the best one
+        known = [a.credits for a in candidates if a.credits is not None]
+        default = max(known) if known else 1
+        return max(
+            candidates,
+            key=lambda a: (a.credits if a.credits is not None else default) / (a.in_flight + 1),
+        )
+
+    async def group_by_owner(self, item_ids):
+        """{account: ids} for `item_ids`, asking the store once for any this worker does not know."""
+        unknown = [i for i in item_ids if i not in self.owners]
+        if unknown and self.store is not None:
+            for item_id, name in (
+                await asyncio.to_thread(self.store.get_owners, unknown)
+            ).items():
+                self._remember_owner(item_id, name)
+        groups = {}
+        for item_id in item_ids:
+            account = self.by_name.get(self.owners.get(item_id)) or self.primary
+            groups.setdefault(account, []).append(item_id)
+        return groups
+
+    def _remember_owner(self, item_id, name):
+        self.owners[item_id] = name
+        self.owners.move_to_end(item_id)
+        while len(self.owners) > OWNERS_MAX:
+            self.owners.popitem(last=False)
+
+    async def _record_owners(self, item_ids, account):
+        for item_id in item_ids:
+            self._remember_owner(item_id, account.name)
+        if self.store is not None:
+            await asyncio.to_thread(
+                self.store.put_owners, item_ids, account.name, OWNERS_MAX
+            )
+
+    def _eject(self, account, seconds, reason):
+        # the last account standing stays in: a pool with nothing to pick fails every request until it returns
+        if not any(a is not account and not a.ejected for a in self.accounts):
+            log.warning("account_kept", account=account.name, reason=reason)
+            return
+        account.eject(seconds, reason)
+
+    @contextmanager
+    def _lease(self, account):
+        account.in_flight += 1
+        try:
+            yield account
+        finally:
+            account.in_flight -= 1
+
+    async def submit(self, call, cost=0):
+        """Run `call(token, retry_throttled)` on the best account, failing over while accounts are rate limited or locked out.
+
+        A 429 is only retried in place on the last account left to try.
+        """
+        tried = set()
+        last_error = None
+        while True:
+            try:
+                account = self.pick(tried, cost)
+            except AccountUnavailable:
+                if last_error is not None:
+                    raise last_error
+                raise
+            tried.add(account.name)
+            last = not any(
+                not a.ejected and a.name not in tried for a in self.accounts
+            )
+            with self._lease(account):
+                try:
+                    return account, await call(await account.get_token(), last)
+                except AccountUnavailable as e:
+                    if e.rejected:
+                        self._eject(account, ACCOUNT_AUTH_EJECT_TIME, "session rejected")
+                    last_error = e
+                except QueueFull:
+                    raise
+                except UpstreamError as e:
+                    # these never start a generation, so another account can safely take it
+                    if e.status_code == 429:
+                        self._eject(
+                            account, e.retry_after or ACCOUNT_EJECT_TIME, "rate limited"
+                        )
+                    elif e.status_code in (401, 403):
+                        self._eject(
+                            account, ACCOUNT_AUTH_EJECT_TIME, "authentication rejected"
+                        )
+                    elif e.status_code == 402:
+                        account.credits = 0
+                    else:
+                        raise
+                    last_error = e
+
+    async def generate(self, data):
+        """Generate on the best account and return the upstream body untouched."""
+        account, body = await self.submit(
+            lambda token, last: generate_music(
+                data, token, raw=True, retry_throttled=last
+            ),
+            GENERATION_COST,
+        )
+        clips = codec.loads(body).get("clips", [])
+        await self._record_owners([clip["id"] for clip in clips], account)
+        if account.credits is not None:
+            account.credits -= GENERATION_COST
+        return body
+
+    async def generate_lyrics(self, prompt):
+        account, body = await self.submit(
+            lambda token, last: generate_lyrics(
+                prompt, token, raw=True, retry_throttled=last
+            )
+        )
+        await self._record_owners([codec.loads(body)["id"]], account)
+        return body
+
+    async def token_for(self, item_id):
+        (account,) = await self.group_by_owner([item_id])
+        return await account.get_token()
+
+    async def refresh_token(self, stale_token):
+        """Token refresher for utils.fetch: refreshes whichever account issued `stale_token`."""
+        for account in self.accounts:
+            if stale_token in account.issued:
+                return await account.refresh_token(stale_token)
+        return await self.primary.refresh_token(stale_token)
+
+
+def load_accounts(store=None):
+    # ACCOUNTS_FILE is a JSON list of {"name", "session_id", "cookie"}; otherwise SESSION_ID and COOKIE make one account
+    if ACCOUNTS_FILE:
+        with open(ACCOUNTS_FILE) as f:
+            entries = json.load(f)
+    else:
+        entries = [
+            {"name": "default", "session_id": os.getenv("SESSION_ID"), "cookie": os.getenv("COOKIE")}
+        ]
+    return [
+        Account(
+            entry.get("name") or f"account{i}", entry["session_id"], entry["cookie"], store
+        )
+        for i, entry in enumerate(entries, start=1)
+    ]
+
+
+_pool = None
+
+
+def init_accounts():
+    """Build the account pool from configuration; the app lifespan calls this."""
+    global _pool
+    store = get_store()
+    _pool = AccountPool(load_accounts(store), store)
+    return _pool
+
+
+def get_pool():
+    if _pool is None:
+        return init_accounts()
+    return _pool
@@ -0,0 +1,240 @@
+#Run uvicorn main:app first
+#Usage: python batch.py manifest.jsonl [--concurrency 4] [--db batch.db]
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import argparse
+import aiohttp
+from dotenv import load_dotenv
+from client import SunoClient, ProxyError, gather_limited
+from polling import Poller
+from tracing import new_trace_id
+
+# Load environment variables from .env file
+load_dotenv()
+
+FEED_BATCH = 50
+SUBMIT_RETRIES = 3
+# The proxy answers 429 when its rate limit queue is full or Suno throttles us, 503 while no account or upstream is available;
+# both mean "later", so the job waits (honouring Retry-After) instead of failing
+THROTTLED_STATUSES = (429, 503)
+THROTTLED_RETRIES = 20
+THROTTLED_MAX_DELAY = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+	key TEXT PRIMARY KEY,
+	payload TEXT NOT NULL,
+	status TEXT NOT NULL,
+	error TEXT,
+	updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clips (
+	clip_id TEXT PRIMARY KEY,
+	job_key TEXT NOT NULL REFERENCES jobs(key),
+	status TEXT NOT NULL,
+	title TEXT,
+	file_path TEXT,
+	updated_at REAL NOT NULL
+);
+"""
+
+class JobStore:
+	# Job status: pending -> submitting -> submitted -> done, or throttled | failed when the proxy turned the submission down.
+	# Throttled jobs are submitted again by the next run; failed ones were rejected for good (bad request, no credits).
+	# A job still 'submitting' after a crash or an interrupted submission may already have spent credits, so it is never resubmitted automatically
+	def __init__(self, path):
+		self.db = sqlite3.connect(path)
+		self.db.executescript(SCHEMA)
+
+	def execute(self, sql, params=()):
+		with self.db:
+			return self.db.execute(sql, params).fetchall()
+
+	def add_job(self, key, payload):
+		self.execute("INSERT OR IGNORE INTO jobs (key, payload, status, updated_at) VALUES (?, ?, 'pending', ?)", (key, json.dumps(payload), time.time()))
+
+	def set_job(self, key, status, error=None):
+		self.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE key = ?", (status, error, time.time(), key))
+
+	def jobs(self, status):
+		return [(key, json.loads(payload)) for key, payload in self.execute("SELECT key, payload FROM jobs WHERE status = ?", (status,))]
+
+	def add_clips(self, key, clip_ids):
+		with self.db:
+			self.db.executemany("INSERT OR IGNORE INTO clips (clip_id, job_key, status, updated_at) VALUES (?, ?, 'submitted', ?)", [(clip_id, key, time.time()) for clip_id in clip_ids])
+			self.db.execute("UPDATE jobs SET status = 'submitted', updated_at = ? WHERE key = ?", (time.time(), key))
+
+	def set_clip(self, clip_id, status, title=None, file_path=None):
+		self.execute("UPDATE clips SET status = ?, title = COALESCE(?, title), file_path = COALESCE(?, file_path), updated_at = ? WHERE clip_id = ?", (status, title, file_path, time.time(), clip_id))
+
+	def pending_clips(self):
+		return [row[0] for row in self.execute("SELECT clip_id FROM clips WHERE status NOT IN ('downloaded', 'error')")]
+
+	def finish_jobs(self):
+		# A submitted job is done once none of its clips are still in progress
+		self.execute("UPDATE jobs SET status = 'done', updated_at = ? WHERE status = 'submitted' AND NOT EXISTS (SELECT 1 FROM clips WHERE clips.job_key = jobs.key AND clips.status NOT IN ('downloaded', 'error'))", (time.time(),))
+
+	def summary(self):
+		jobs = dict(self.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+		clips = dict(self.execute("SELECT status, COUNT(*) FROM clips GROUP BY status"))
+		return f"jobs {jobs}, clips {clips}"
+
+def load_manifest(path):
+	# A JSON list or one JSON object per line. Description mode: {"description": ..., "instrumental": false};
+	# custom mode: {"lyrics": ..., "title": ..., "tags": ...}. An optional "id" names the job, otherwise its content does
+	with open(path, 'r') as f:
+		text = f.read().strip()
+	entries = json.loads(text) if text.startswith('[') else [json.loads(line) for line in text.splitlines() if line.strip()]
+	jobs = []
+	for number, entry in enumerate(entries, 1):
+		# Checked up front, so one bad entry stops the run before anything is submitted
+		if not isinstance(entry, dict):
+			raise ValueError(f"{path}: entry {number} is not a JSON object")
+		missing = [field for field in (('description',) if 'description' in entry else ('lyrics', 'title', 'tags')) if not isinstance(entry.get(field), str)]
+		if missing:
+			raise ValueError(f"{path}: entry {number} needs a \"description\", or \"lyrics\", \"title\" and \"tags\"; missing or not text: {', '.join(missing)}")
+		key = entry.get('id') or hashlib.sha1(json.dumps(entry, sort_keys=True).encode()).hexdigest()[:16]
+		jobs.append((key, entry))
+	return jobs
+
+def idempotency_key(key, data):
+	return "batch-" + hashlib.sha1(json.dumps([key, data], sort_keys=True).encode()).hexdigest()
+
+async def submit(client, store, key, entry):
+	if 'description' in entry:
+		data = {"gpt_description_prompt": entry['description'], "make_instrumental": entry.get('instrumental', False), "mv": entry.get('mv', "chirp-v3-0")}
+		generate = lambda **kwargs: client.generate_description(data['gpt_description_prompt'], data['make_instrumental'], data['mv'], **kwargs)
+	else:
+		data = {"prompt": entry['lyrics'], "mv": entry.get('mv', "chirp-v3-0"), "title": entry['title'], "tags": entry['tags']}
+		generate = lambda **kwargs: client.generate(data['prompt'], data['title'], data['tags'], data['mv'], **kwargs)
+
+	store.set_job(key, 'submitting')
+	trace_id = new_trace_id()
+	# The same key on every attempt and run, so the proxy answers a repeat with the first generation instead of spending credits again
+	idempotency = idempotency_key(key, data)
+	interrupted = throttled = 0
+	try:
+		while True:
+			try:
+				clips = await generate(idempotency_key=idempotency, trace_id=trace_id)
+				break
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+				interrupted += 1
+				if interrupted == SUBMIT_RETRIES:
+					raise
+				delay = 2 ** interrupted
+				print(f"Job {key} submission interrupted ({e!r}), retrying {interrupted}/{SUBMIT_RETRIES - 1}")
+			except ProxyError as e:
+				if e.status not in THROTTLED_STATUSES:
+					raise
+				throttled += 1
+				if throttled > THROTTLED_RETRIES:
+					raise
+				delay = max(1, e.retry_after) if e.retry_after is not None else min(THROTTLED_MAX_DELAY, 2 ** throttled)
+				print(f"Job {key} throttled ({e.status}), retrying in {delay:.0f}s")
+			await asyncio.sleep(delay)
+		clip_ids = [clip.id for clip in clips]
+	except ProxyError as e:
+		if e.status in THROTTLED_STATUSES or e.status < 500:
+			# The proxy turned it down before generating: throttled jobs go again next run, other 4xx (422, 402, ...) won't get better
+			status = 'throttled' if e.status in THROTTLED_STATUSES else 'failed'
+			print(f"Job {key} {status} (trace {trace_id}): {e!r}")
+			store.set_job(key, status, str(e))
+		else:
+			# An upstream error may come after the generation started; left 'submitting' for --resubmit-unknown
+			print(f"Job {key} outcome unknown (trace {trace_id}): {e!r}")
+			store.set_job(key, 'submitting', str(e))
+		return
+	except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+		# The last attempt may have reached the proxy, so whether it generated is unknown
+		print(f"Job {key} outcome unknown after {SUBMIT_RETRIES} interrupted attempts (trace {trace_id}): {e!r}")
+		store.set_job(key, 'submitting', str(e))
+		return
+	store.add_clips(key, clip_ids)
+	print(f"Job {key} submitted (trace {trace_id}): {clip_ids}")
+
+async def track(client, store, output_dir, submissions, concurrency):
+	# One bulk /feed call per FEED_BATCH clips each round; completed clips are downloaded concurrently
+	async def check():
+		clip_ids = store.pending_clips()
+		statuses = set()
+		ready = []
+		for start in range(0, len(clip_ids), FEED_BATCH):
+			for clip in await client.get_clips(clip_ids[start:start + FEED_BATCH]):
+				statuses.add(clip.status)
+				if clip.status == 'complete':
+					ready.append(clip)
+				elif clip.status == 'error':
+					store.set_clip(clip.id, 'error')
+				else:
+					store.set_clip(clip.id, clip.status)
+
+		jobs = [(clip.cdn_audio_url, os.path.join(output_dir, f"{(clip.title or 'song').replace(' ', '-')}-{clip.id[:8]}.mp3")) for clip in ready]
+		for clip, file_path in zip(ready, await client.download_all(jobs, concurrency)):
+			if file_path:
+				store.set_clip(clip.id, 'downloaded', clip.title, file_path)
+				print(f"Downloaded {file_path}")
+		store.finish_jobs()
+
+		if not store.pending_clips() and submissions.done():
+			return 'complete', None
+		return ('streaming' if 'streaming' in statuses else 'submitted'), None
+
+	await Poller(deadline=24 * 3600).run_async(check)
+
+async def run(store, jobs, output_dir, concurrency):
+	# Polls carry the run's trace; each submission gets a trace of its own
+	async with SunoClient(max_connections=concurrency * 2) as client:
+		print(f"Resuming: {store.summary()}, trace ID {client.trace_id}")
+		submissions = asyncio.ensure_future(gather_limited([submit(client, store, key, entry) for key, entry in jobs], concurrency))
+		try:
+			await track(client, store, output_dir, submissions, concurrency)
+		finally:
+			await submissions
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("manifest", help="JSON or JSONL file with one prompt per entry")
+	parser.add_argument("--db", help="SQLite file holding the job state", default="batch.db")
+	parser.add_argument("--output", help="Directory for downloaded songs", default=os.path.join("songs", "batch"))
+	parser.add_argument("--concurrency", help="Maximum concurrent submissions and downloads", type=int, default=4)
+	parser.add_argument("--resubmit-unknown", help="Resubmit jobs interrupted mid-submission (free while the proxy still remembers them: until it restarts, or for IDEMPOTENCY_TTL with TOKEN_STORE set; may spend credits twice after that)", action="store_true")
+	args = parser.parse_args()
+
+	os.makedirs(args.output, exist_ok=True)
+	try:
+		jobs = load_manifest(args.manifest)
+	except ValueError as e:
+		parser.error(str(e))
+	store = JobStore(args.db)
+	for key, entry in jobs:
+		store.add_job(key, entry)
+
+	throttled = store.jobs('throttled')
+	if throttled:
+		# The proxy refused these before generating anything, so submitting them again cannot spend credits twice
+		print(f"Retrying {len(throttled)} throttled job(s)")
+		for key, _ in throttled:
+			store.set_job(key, 'pending')
+	failed = store.jobs('failed')
+	if failed:
+		print(f"{len(failed)} job(s) were rejected by the proxy and are skipped: {[key for key, _ in failed]}")
+
+	unknown = store.jobs('submitting')
+	if unknown and args.resubmit_unknown:
+		for key, _ in unknown:
+			store.set_job(key, 'pending')
+	elif unknown:
+		print(f"{len(unknown)} job(s) were interrupted mid-submission and are skipped; use --resubmit-unknown to retry them: {[key for key, _ in unknown]}")
+
+	try:
+		asyncio.run(run(store, store.jobs('pending'), args.output, args.concurrency))
+	finally:
+		print(f"Finished: {store.summary()}")
+
+if __name__ == "__main__":
+	main()
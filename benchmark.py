@@ -0,0 +1,223 @@
+# -*- coding:utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+import aiohttp
+
+from fakeupstream import FakeSuno, start
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ("feed", "feed_bulk", "generate", "generate_lyrics", "lyrics")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(session, url, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"proxy did not start within {timeout}s")
+
+
+def make_request(name, proxy_url, clip_ids, lyric_ids):
+    if name == "feed":
+        return "GET", f"{proxy_url}/feed/{random.choice(clip_ids)}", None
+    if name == "feed_bulk":
+        return "GET", f"{proxy_url}/feed?ids={','.join(random.sample(clip_ids, 5))}", None
+    if name == "generate":
+        return "POST", f"{proxy_url}/generate/description-mode", {
+            "gpt_description_prompt": "a benchmark song"
+        }
+    if name == "generate_lyrics":
+        return "POST", f"{proxy_url}/generate/lyrics/", {"prompt": "benchmark"}
+    return "GET", f"{proxy_url}/lyrics/{random.choice(lyric_ids)}", None
+
+
+async def run_scenario(session, name, args, proxy_url, clip_ids, lyric_ids):
+    latencies = []
+    statuses = Counter()
+    end = time.perf_counter() + args.duration
+
+    async def worker():
+        while time.perf_counter() < end:
+            method, url, body = make_request(name, proxy_url, clip_ids, lyric_ids)
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, json=body) as resp:
+                    await resp.read()
+                    statuses[resp.status] += 1
+            except aiohttp.ClientError:
+                statuses["error"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status == 200)
+    return {
+        "requests": len(latencies),
+        "errors": len(latencies) - ok,
+        "throughput": len(latencies) / elapsed,
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "status": {str(k): v for k, v in statuses.items()},
+    }
+
+
+async def seed(session, proxy_url, clips, lyrics):
+    clip_ids, lyric_ids = [], []
+    for _ in range(max(1, clips // 2)):
+        async with session.post(
+            f"{proxy_url}/generate/description-mode",
+            json={"gpt_description_prompt": "seed"},
+        ) as resp:
+            clip_ids += [clip["id"] for clip in (await resp.json())["clips"]]
+    for _ in range(lyrics):
+        async with session.post(
+            f"{proxy_url}/generate/lyrics/", json={"prompt": "seed"}
+        ) as resp:
+            lyric_ids.append((await resp.json())["id"])
+    return clip_ids, lyric_ids
+
+
+async def run(args):
+    fake = FakeSuno(latency=args.upstream_latency)
+    runner, upstream_url = await start(fake)
+    port = free_port()
+    proxy_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        BASE_URL=upstream_url,
+        CLERK_URL=upstream_url,
+        SESSION_ID="bench",
+        COOKIE="__client=bench",
+    )
+    # the proxy's own rate limits would otherwise be what gets measured
+    for kind in ("GENERATE", "FEED", "LYRICS"):
+        env.setdefault(f"RATE_LIMIT_{kind}", "100000")
+        env.setdefault(f"RATE_BURST_{kind}", "100000")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    proxy = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)]
+        + ["--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "scenarios": {},
+    }
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_ready(session, f"{proxy_url}/")
+            clip_ids, lyric_ids = await seed(session, proxy_url, 50, 20)
+            for name in args.scenarios:
+                before = Counter(fake.calls)
+                stats = await run_scenario(
+                    session, name, args, proxy_url, clip_ids, lyric_ids
+                )
+                upstream = dict(Counter(fake.calls) - before)
+                stats["upstream_calls"] = upstream
+                stats["upstream_per_request"] = (
+                    sum(upstream.values()) / stats["requests"] if stats["requests"] else None
+                )
+                results["scenarios"][name] = stats
+                print_row(name, stats)
+    finally:
+        proxy.terminate()
+        proxy.wait()
+        await runner.cleanup()
+    return results
+
+
+def fmt_ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+
+def print_row(name, stats):
+    print(
+        f"{name:<16} {stats['requests']:>7} req {stats['throughput']:>9.1f} req/s"
+        f"  p50 {fmt_ms(stats['p50']):>7}ms  p95 {fmt_ms(stats['p95']):>7}ms"
+        f"  p99 {fmt_ms(stats['p99']):>7}ms  errors {stats['errors']}"
+        f"  upstream/req {stats['upstream_per_request'] or 0:.2f}"
+    )
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline['timestamp']}):")
+    for name, stats in results["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if not old:
+            continue
+        deltas = []
+        for key in ("throughput", "p50", "p95", "p99"):
+            if old.get(key) and stats.get(key) is not None:
+                deltas.append(f"{key} {(stats[key] - old[key]) / old[key] * 100:+.1f}%")
+        print(f"{name:<16} " + "  ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test main.app against a local fake Suno/Clerk upstream"
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument(
+        "--upstream-latency", type=float, default=0.02, help="simulated upstream latency"
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--output", help="results file (default bench_results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    output = args.output or os.path.join(
+        ROOT, "bench_results", f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
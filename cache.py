@@ -0,0 +1,60 @@
+# -*- coding:utf-8 -*-
+
+import os
+import time
+from collections import OrderedDict
+
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "5000"))
+FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", "3"))
+
+# statuses whose feed record no longer changes, so it is cached without a TTL
+IMMUTABLE_STATUSES = ("complete",)
+
+
+class FeedCache:
+    """LRU cache of feed records; completed clips never expire, others live for `ttl` seconds."""
+
+    def __init__(self, max_entries=FEED_CACHE_SIZE, ttl=FEED_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, clip_id):
+        entry = self._entries.get(clip_id)
+        if entry is not None:
+            expires_at, clip = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._entries.move_to_end(clip_id)
+                self.hits += 1
+                return clip
+            del self._entries[clip_id]
+        self.misses += 1
+        return None
+
+    def put(self, clip):
+        clip_id = clip.get("id")
+        if clip_id is None:
+            return
+        if clip.get("status") in IMMUTABLE_STATUSES:
+            expires_at = None
+        elif self.ttl > 0:
+            expires_at = time.monotonic() + self.ttl
+        else:
+            return
+        self._entries[clip_id] = (expires_at, clip)
+        self._entries.move_to_end(clip_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,19 @@
+import io
+
+class FlacEncoder:
+	# Encodes 16-bit PCM chunks to FLAC in memory as they are captured, so raw audio is never accumulated
+	def __init__(self, rate, channels):
+		import soundfile as sf	# Imported on first use, only recording needs it
+		self.buffer = io.BytesIO()
+		self.file = sf.SoundFile(self.buffer, mode='w', samplerate=rate, channels=channels, format='FLAC', subtype='PCM_16')
+		self.raw_bytes = 0
+
+	def write(self, pcm):
+		self.file.buffer_write(pcm, dtype='int16')
+		self.raw_bytes += len(pcm)
+
+	def finish(self):
+		self.file.close()
+		data = self.buffer.getvalue()
+		print(f"Encoded {self.raw_bytes} bytes of PCM to {len(data)} bytes of FLAC")
+		return data
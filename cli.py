@@ -0,0 +1,34 @@
+#Usage: python cli.py <command> [args...], e.g. python cli.py custom --progressive
+#A command's module is only imported when that command runs, so startup stays fast
+import runpy
+import sys
+
+COMMANDS = {
+	"serve": ("uvicorn", ["main:app"], "Run the proxy (uvicorn main:app)"),
+	"custom": ("customprompt", [], "Generate from a description or lyrics.txt and play the songs"),
+	"manual": ("manualprompt", [], "Generate from a typed description and download the songs"),
+	"dictate": ("dictateprompt", [], "Generate from a dictated description and download the songs"),
+	"batch": ("batch", [], "Generate every prompt of a manifest, resumable"),
+	"details": ("getdetails", [], "Wait for a song's audio URL"),
+	"bench": ("benchmark", [], "Load-test the proxy against a local fake upstream"),
+	"fake-upstream": ("fakeupstream", [], "Serve the local Suno/Clerk stand-in"),
+	"import-time": ("importbench", [], "Measure how long each program takes to import"),
+}
+
+def usage():
+	lines = ["usage: python cli.py <command> [args...]", "", "commands:"]
+	lines += [f"  {name:<14} {description}" for name, (_, _, description) in COMMANDS.items()]
+	return "\n".join(lines)
+
+def main(argv=None):
+	argv = sys.argv[1:] if argv is None else argv
+	if not argv or argv[0] not in COMMANDS:
+		print(usage())
+		return 0 if argv[:1] in ([], ["-h"], ["--help"]) else 2
+	module, prefix, _ = COMMANDS[argv[0]]
+	sys.argv = [argv[0]] + prefix + argv[1:]
+	runpy.run_module(module, run_name="__main__", alter_sys=True)
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,270 @@
+#Async client for the proxy (uvicorn main:app) and the Suno CDN.
+#One pooled keep-alive session serves every call, so connections are set up once per run rather than per request
+import os
+import re
+import json
+import asyncio
+from contextlib import aclosing
+from dataclasses import dataclass, field
+import aiohttp
+from polling import FINAL_STATUSES
+from resilience import parse_retry_after
+from tagging import cached_cover, store_cover
+from tracing import TRACE_HEADER, new_trace_id
+
+PROXY_URL = os.getenv("PROXY_URL", "http://127.0.0.1:8000")
+CDN_URL = os.getenv("CDN_URL", "https://cdn1.suno.ai")
+MAX_CONNECTIONS = 8
+CHUNK_SIZE = 64 * 1024
+RETRIES = 3
+
+class ProxyError(Exception):
+	def __init__(self, status, detail, retry_after=None):
+		super().__init__(f"{status}: {detail}")
+		self.status = status
+		self.detail = detail
+		self.retry_after = retry_after	# seconds, from the proxy's Retry-After header
+
+class IncompleteDownload(Exception):
+	pass
+
+@dataclass
+class Clip:
+	id: str
+	status: str
+	title: str = ""
+	audio_url: str = ""
+	image_url: str = ""
+	metadata: dict = field(default_factory=dict)
+
+	@classmethod
+	def from_json(cls, data):
+		return cls(data['id'], data.get('status', ''), data.get('title') or "", data.get('audio_url') or "", data.get('image_large_url') or "", data.get('metadata') or {})
+
+	@property
+	def cdn_audio_url(self):
+		return f"{CDN_URL}/{self.id}.mp3"
+
+	@property
+	def lyrics(self):
+		return self.metadata.get('prompt', '')
+
+	@property
+	def description(self):
+		return self.metadata.get('gpt_description_prompt', '')
+
+	@property
+	def playable(self):
+		# A streaming clip can be played once the upstream has an audio URL for it
+		return self.status == 'complete' or (self.status == 'streaming' and bool(self.audio_url))
+
+@dataclass
+class Lyrics:
+	id: str
+	status: str
+	title: str = ""
+	text: str = ""
+
+def _submit_headers(idempotency_key, trace_id):
+	headers = {}
+	if idempotency_key:
+		headers['Idempotency-Key'] = idempotency_key
+	if trace_id:
+		headers[TRACE_HEADER] = trace_id
+	return headers
+
+def _expected_size(response, offset):
+	# 206 responses carry the full size in Content-Range ("bytes 100-999/1000")
+	match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+	if match:
+		return int(match.group(1))
+	if response.content_length is not None:
+		return offset + response.content_length
+	return None
+
+class SunoClient:
+	# Use as "async with SunoClient() as client:"; every method may be called concurrently
+	def __init__(self, proxy_url=PROXY_URL, trace_id=None, max_connections=MAX_CONNECTIONS, timeout=120):
+		self.proxy_url = proxy_url.rstrip('/')
+		self.trace_id = trace_id or new_trace_id()
+		self.max_connections = max_connections
+		self.timeout = timeout
+		self.headers = {'Cookie': f'session_id={os.getenv("SESSION_ID")}; {os.getenv("COOKIE")}', TRACE_HEADER: self.trace_id}
+		self.session = None
+		self.server_timing = None	# Server-Timing of the last proxy response
+
+	async def __aenter__(self):
+		connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+		self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout, connect=10))
+		return self
+
+	async def __aexit__(self, *exc):
+		await self.session.close()
+
+	async def _request(self, method, path, json=None, params=None, headers=None):
+		async with self.session.request(method, f"{self.proxy_url}{path}", json=json, params=params, headers={**self.headers, **(headers or {})}) as response:
+			if response.status != 200:
+				raise ProxyError(response.status, await response.text(), parse_retry_after(response.headers.get('Retry-After')))
+			self.server_timing = response.headers.get('Server-Timing')
+			return await response.json()
+
+	# With an idempotency_key, repeating a call (e.g. after a timeout) returns the first call's clips instead of generating again.
+	# trace_id, if given, replaces the client's trace for this call only
+	async def generate(self, lyrics, title, tags, mv="chirp-v3-0", idempotency_key=None, trace_id=None):
+		data = await self._request('POST', "/generate", {"prompt": lyrics, "mv": mv, "title": title, "tags": tags}, headers=_submit_headers(idempotency_key, trace_id))
+		return [Clip.from_json(clip) for clip in data['clips']]
+
+	async def generate_description(self, description, instrumental=False, mv="chirp-v3-0", idempotency_key=None, trace_id=None):
+		data = await self._request('POST', "/generate/description-mode", {"gpt_description_prompt": description, "make_instrumental": instrumental, "mv": mv}, headers=_submit_headers(idempotency_key, trace_id))
+		return [Clip.from_json(clip) for clip in data['clips']]
+
+	async def get_clips(self, clip_ids):
+		return [Clip.from_json(clip) for clip in await self._request('GET', "/feed", params={"ids": ",".join(clip_ids)})]
+
+	async def get_clip(self, clip_id):
+		clips = await self._request('GET', f"/feed/{clip_id}")
+		return Clip.from_json(clips[0]) if clips else None
+
+	async def generate_lyrics(self, prompt):
+		return (await self._request('POST', "/generate/lyrics/", {"prompt": prompt}))['id']
+
+	async def get_lyrics(self, lyrics_id):
+		data = await self._request('GET', f"/lyrics/{lyrics_id}")
+		return Lyrics(lyrics_id, data.get('status', ''), data.get('title') or "", data.get('text') or "")
+
+	async def stream_clips(self, clip_ids):
+		# Server-Sent Events from /feed/stream as (event, data) pairs, "clip" data as a Clip
+		timeout = aiohttp.ClientTimeout(total=None, connect=10)
+		async with self.session.get(f"{self.proxy_url}/feed/stream", params={"ids": ",".join(clip_ids)}, headers=self.headers, timeout=timeout) as response:
+			if response.status != 200:
+				raise ProxyError(response.status, await response.text())
+			event = None
+			async for line in response.content:
+				line = line.decode().strip()
+				if line.startswith("event:"):
+					event = line[len("event:"):].strip()
+				elif line.startswith("data:"):
+					data = json.loads(line[len("data:"):])
+					yield event, Clip.from_json(data) if event == "clip" else data
+
+	async def wait_for_clips(self, clip_ids, ready=None):
+		# Returns {id: Clip} once every clip is ready (finished by default) or the proxy gives up watching
+		ready = ready or (lambda clip: clip.status in FINAL_STATUSES)
+		clips = {}
+		async with aclosing(self.stream_clips(clip_ids)) as events:
+			async for event, data in events:
+				if event == "clip":
+					clips[data.id] = data
+					print(f"Clip {data.id} is {data.status}")
+					if len(clips) == len(set(clip_ids)) and all(ready(clip) for clip in clips.values()):
+						break
+				elif event == "error":
+					print(f"Error while watching clips: {data.get('detail')}")
+				elif event in ("done", "timeout"):
+					break
+		return clips
+
+	async def download(self, url, file_path, on_chunk=None, retries=RETRIES):
+		# Streams to <file_path>.part, resuming with a Range request if interrupted, then renames atomically.
+		# on_chunk, if given, receives every byte exactly once, on a worker thread so a blocking consumer such as a player pipe cannot stall the loop
+		part_path = file_path + '.part'
+		for attempt in range(1, retries + 1):
+			try:
+				if not await self._fetch(url, part_path, on_chunk):
+					return None
+				os.replace(part_path, file_path)
+				return file_path
+			except (aiohttp.ClientError, asyncio.TimeoutError, IncompleteDownload) as e:
+				print(f"Download of {url} interrupted ({e}), attempt {attempt}/{retries}")
+		print(f"Failed to download {url} after {retries} attempts")
+		return None
+
+	async def _fetch(self, url, part_path, on_chunk):
+		offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+		delivered = offset	# bytes already handed to on_chunk by an earlier attempt
+		headers = {'Accept-Encoding': 'identity'}
+		if offset:
+			headers['Range'] = f'bytes={offset}-'
+
+		timeout = aiohttp.ClientTimeout(total=None, connect=10, sock_read=60)
+		async with self.session.get(url, headers=headers, timeout=timeout) as response:
+			if response.status == 416:
+				# The partial file no longer matches the remote one, start over
+				os.remove(part_path)
+				raise IncompleteDownload("range not satisfiable")
+			if response.status == 200:
+				offset = 0
+			elif response.status != 206:
+				print("Failed to download the song:", response.status, await response.text())
+				return False
+
+			expected = _expected_size(response, offset)
+			position = offset
+			with open(part_path, 'ab' if offset else 'wb') as f:
+				async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+					f.write(chunk)
+					if on_chunk and position + len(chunk) > delivered:
+						await asyncio.to_thread(on_chunk, chunk[max(0, delivered - position):])
+					position += len(chunk)
+
+		size = os.path.getsize(part_path)
+		if expected is not None and size != expected:
+			raise IncompleteDownload(f"got {size} of {expected} bytes")
+		return True
+
+	async def download_all(self, jobs, concurrency=MAX_CONNECTIONS):
+		# jobs is a list of (url, file_path); returns the file paths (None for failures) in the same order
+		return await gather_limited([self.download(url, file_path) for url, file_path in jobs], concurrency)
+
+	async def fetch_cover(self, image_url):
+		# Album art through the shared on-disk cover cache
+		if not image_url:
+			return None
+		data = await asyncio.to_thread(cached_cover, image_url)
+		if data is not None:
+			return data
+		try:
+			async with self.session.get(image_url) as response:
+				if response.status != 200:
+					print("Failed to fetch album art:", response.status)
+					return None
+				data = await response.read()
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			print(f"Failed to fetch album art: {e}")
+			return None
+		await asyncio.to_thread(store_cover, image_url, data)
+		return data
+
+async def gather_limited(coros, limit):
+	# Like asyncio.gather, with at most `limit` of the coroutines running at once
+	slots = asyncio.Semaphore(limit)
+
+	async def run(coro):
+		async with slots:
+			return await coro
+
+	return await asyncio.gather(*[run(coro) for coro in coros])
+
+async def generate_and_download(description, output_dir="."):
+	# Description mode end to end: generate, wait for the proxy to report the clips finished, download them concurrently
+	async with SunoClient() as client:
+		print(f"Trace ID: {client.trace_id}")	# Sent with every proxy call of this run, so its proxy logs can be found
+		try:
+			clips = await client.generate_description(description)
+		except ProxyError as e:
+			print("Failed to initiate song generation:", e.status, e.detail)
+			return []
+		if not clips:
+			print("No clips generated or available in response.")
+			return []
+		clip_ids = [clip.id for clip in clips]
+		print(f"Clip IDs found: {clip_ids}")
+		print(f"Proxy timing: {client.server_timing}")
+
+		print("Waiting for the song to be processed...")
+		clips = await client.wait_for_clips(clip_ids)
+		jobs = [(clip.cdn_audio_url, os.path.join(output_dir, f"{clip.id}.mp3")) for clip in clips.values() if clip.status == 'complete']
+		file_paths = [file_path for file_path in await client.download_all(jobs) if file_path]
+		for file_path in file_paths:
+			print(f"Song downloaded successfully: {file_path}")
+		return file_paths
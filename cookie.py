@@ -1,13 +1,30 @@
 # -*- coding:utf-8 -*-
 
+import asyncio
+import base64
+import json
+import logging
 import os
+import sqlite3
 import time
 from http.cookies import SimpleCookie
-from threading import Thread
 
-import requests
+import aiohttp
 
-from utils import COMMON_HEADERS
+from tracing import get_logger, span
+from utils import COMMON_HEADERS, get_session
+
+CLERK_URL = os.getenv("CLERK_URL", "https://clerk.suno.com")
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "10"))
+TOKEN_FALLBACK_TTL = float(os.getenv("TOKEN_FALLBACK_TTL", "30"))
+CLERK_TIMEOUT = float(os.getenv("CLERK_TIMEOUT", "10"))
+TOKEN_STORE_POLL = 0.1
+
+log = get_logger("auth")
+
+
+class AuthRejected(Exception):
+    """Clerk refused the session itself, as opposed to being unreachable or failing."""
 
 
 class SunoCookie:
@@ -35,43 +52,155 @@ class SunoCookie:
         self.token = token
 
 
-suno_auth = SunoCookie()
-suno_auth.set_session_id(os.getenv("SESSION_ID"))
-suno_auth.load_cookie(os.getenv("COOKIE"))
+def token_expiry(token):
+    """Return the `exp` claim of a JWT without verifying it, or None."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
 
 
-def update_token(suno_cookie: SunoCookie):
+async def update_token(suno_cookie: SunoCookie, timeout=CLERK_TIMEOUT):
     headers = {"cookie": suno_cookie.get_cookie()}
     headers.update(COMMON_HEADERS)
     session_id = suno_cookie.get_session_id()
 
-    resp = requests.post(
-        url=f"https://clerk.suno.com/v1/client/sessions/{session_id}/tokens?_clerk_js_version=4.72.0-snapshot.vc141245",
+    session = await get_session()
+    async with session.post(
+        url=f"{CLERK_URL}/v1/client/sessions/{session_id}/tokens?_clerk_js_version=4.72.0-snapshot.vc141245",
         headers=headers,
-    )
-
-    resp_headers = dict(resp.headers)
-    set_cookie = resp_headers.get("Set-Cookie")
-    suno_cookie.load_cookie(set_cookie)
-    token = resp.json().get("jwt")
+        timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as resp:
+        for set_cookie in resp.headers.getall("Set-Cookie", []):
+            suno_cookie.load_cookie(set_cookie)
+        if 400 <= resp.status < 500 and resp.status != 429:
+            raise AuthRejected(f"Clerk rejected the session with status {resp.status}")
+        body = await resp.json(content_type=None)
+
+    token = body.get("jwt")
+    if not token:
+        raise Exception(f"token refresh failed with status {resp.status}")
     suno_cookie.set_token(token)
-    # print(set_cookie)
-    # print(f"*** token -> {token} ***")
-
-
-def keep_alive(suno_cookie: SunoCookie):
-    while True:
+    return token
+
+
+class TokenManager:
+    """Hands out the session JWT, refreshing it shortly before it expires.
+
+    With a `store` (tokenstore.TokenStore) the token and cookies are shared by
+    every process using the store, and only the process holding the store's
+    lease calls Clerk; the others pick up what it publishes.
+    """
+
+    def __init__(self, suno_cookie: SunoCookie, margin=TOKEN_REFRESH_MARGIN, store=None):
+        self.suno_cookie = suno_cookie
+        self.margin = margin
+        self.store = store
+        self.expires_at = None
+        self.refreshed_at = None
+        self.refresh_count = 0
+        self._refresh = None
+
+    def is_fresh(self):
+        return (
+            self.suno_cookie.get_token() is not None
+            and self.expires_at is not None
+            and time.time() < self.expires_at - self.margin
+        )
+
+    async def get_token(self):
+        if self.is_fresh():
+            return self.suno_cookie.get_token()
+        return await self.refresh()
+
+    async def refresh(self, stale_token=None):
+        # a 401 on a token that has already been replaced needs no second refresh
+        current = self.suno_cookie.get_token()
+        if stale_token is not None and current != stale_token and self.is_fresh():
+            return current
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._do_refresh(stale_token))
+        return await asyncio.shield(self._refresh)
+
+    async def _do_refresh(self, stale_token=None):
         try:
-            update_token(suno_cookie)
-        except Exception as e:
-            print(e)
+            if self.store is None:
+                return await self._refresh_from_clerk()
+            try:
+                return await self._refresh_shared(stale_token)
+            except sqlite3.Error as e:
+                log.warning("token_store_failed", error=str(e))
+                return await self._refresh_from_clerk()
         finally:
-            time.sleep(5)
-
-
-def start_keep_alive(suno_cookie: SunoCookie):
-    t = Thread(target=keep_alive, args=(suno_cookie,))
-    t.start()
+            self._refresh = None
+
+    async def _refresh_from_clerk(self, timeout=CLERK_TIMEOUT):
+        with span("token_refresh", logging.INFO, count=self.refresh_count + 1):
+            token = await update_token(self.suno_cookie, timeout)
+        now = time.time()
+        self.expires_at = token_expiry(token) or now + TOKEN_FALLBACK_TTL
+        self.refreshed_at = now
+        self.refresh_count += 1
+        return token
+
+    async def _refresh_shared(self, stale_token):
+        session_id = self.suno_cookie.get_session_id()
+        with span("token_store"):
+            while True:
+                if self._adopt(await asyncio.to_thread(self.store.load, session_id), stale_token):
+                    return self.suno_cookie.get_token()
+                if await asyncio.to_thread(self.store.acquire_lease, session_id):
+                    break
+                # another process is refreshing; its token shows up in the store shortly
+                await asyncio.sleep(TOKEN_STORE_POLL)
+            # the previous leader may have published between our read and taking the lease
+            if self._adopt(await asyncio.to_thread(self.store.load, session_id), stale_token):
+                await asyncio.to_thread(self.store.release_lease, session_id)
+                return self.suno_cookie.get_token()
 
-
-start_keep_alive(suno_auth)
+        try:
+            # well inside the lease, so no other process takes over while Clerk is still answering us
+            token = await self._refresh_from_clerk(min(CLERK_TIMEOUT, self.store.lease_time / 2))
+        except BaseException:
+            await asyncio.to_thread(self.store.release_lease, session_id)
+            raise
+        # the token is good whatever happens to the store; failing to publish it only costs the others a refresh
+        try:
+            published = await asyncio.to_thread(
+                self.store.save,
+                session_id,
+                token,
+                self.suno_cookie.get_cookie(),
+                self.expires_at,
+                self.refreshed_at,
+            )
+            if not published:
+                log.warning("token_lease_lost", session=session_id)
+        except sqlite3.Error as e:
+            log.warning("token_store_failed", error=str(e))
+            try:
+                await asyncio.to_thread(self.store.release_lease, session_id)
+            except sqlite3.Error:
+                pass  # the lease runs out on its own
+        return token
+
+    def _adopt(self, row, stale_token):
+        """Take over a token another process stored, if it is usable."""
+        if row is None:
+            return False
+        token, cookie, expires_at, refreshed_at = row
+        if (
+            not token
+            or token == stale_token
+            or expires_at is None
+            or time.time() >= expires_at - self.margin
+        ):
+            return False
+        self.suno_cookie.set_token(token)
+        if cookie:
+            self.suno_cookie.load_cookie(cookie)
+        self.expires_at = expires_at
+        self.refreshed_at = refreshed_at
+        return True
@@ -1,122 +1,55 @@
-#Ensure your path in line 91 points to your ffplay.exe file.
+#ffplay is taken from the FFPLAY_PATH environment variable or your PATH.
 #Run uvicorn main:app first
 import os
-import requests
 import argparse
+import asyncio
+import threading
 from dotenv import load_dotenv
-import time
-import keyboard
-import json
-import subprocess
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, TIT2, USLT
-from pathlib import Path
+from client import ProxyError, SunoClient
+from tagging import write_tags
+from player import LiveAudio, Playlist, PlayerController, spawn_stdin_player
 
 # Load environment variables from .env file
 load_dotenv()
 
-def get_audio_url_from_clip_id(clip_id):
-	audio_url = f"https://cdn1.suno.ai/{clip_id}.mp3"
-	print(f"Constructed Audio URL: {audio_url}")
-	return audio_url
+MAX_DOWNLOADS = 4
 
-def fetch_song_details(clip_id):
-	url = f"http://127.0.0.1:8000/feed/{clip_id}"
-	headers = {'Cookie': f'session_id={os.getenv("SESSION_ID")}; {os.getenv("COOKIE")}'}
-	while True:
-		response = requests.get(url, headers=headers)
-		if response.status_code == 200:
-			response_json = response.json()
-			song_details = response_json[0] if isinstance(response_json, list) else response_json
-			if song_details.get('status') == 'complete':  # Check if status is 'complete'
-				print("All song details are complete.")
-				return song_details
-			else:
-				print("Song details not complete yet, polling again in 5 seconds.")
-				time.sleep(5)
-		else:
-			print(f"Failed to fetch song details: {response.status_code} {response.text}")
-			return {}
-
-def initiate_song_generation(description):
-	url = "http://127.0.0.1:8000/generate/description-mode"
-	headers = {'Cookie': f'session_id={os.getenv("SESSION_ID")}; {os.getenv("COOKIE")}'}
-	data = {"gpt_description_prompt": description, "make_instrumental": False, "mv": "chirp-v3-0"}
-	response = requests.post(url, json=data, headers=headers)
-	if response.status_code == 200:
-		response_data = response.json()
-		print("Response Data from Generation:", json.dumps(response_data, indent=4))
-		return [clip['id'] for clip in response_data['clips']]
-	else:
-		print("Failed to initiate song generation:", response.status_code, response.text)
+async def wait_for_song(client, clip_id, progressive=False):
+	# With progressive set, a clip that is streaming with an audio URL is ready as well as a finished one
+	ready = (lambda clip: clip.playable or clip.status == 'error') if progressive else None
+	clip = (await client.wait_for_clips([clip_id], ready)).get(clip_id)
+	if clip is None:
+		print(f"Failed to fetch song details for {clip_id}")
 		return None
-
-def initiate_custom_song_generation(lyrics, genre, title):
-	url = "http://127.0.0.1:8000/generate"
-	headers = {'Cookie': f'session_id={os.getenv("SESSION_ID")}; {os.getenv("COOKIE")}'}
-	data = {"prompt": lyrics, "mv": "chirp-v3-0", "title": title, "tags": genre}
-	response = requests.post(url, json=data, headers=headers)
-	if response.status_code == 200:
-		response_data = response.json()
-		print("Response Data from Custom Generation:", json.dumps(response_data, indent=4))
-		return [clip['id'] for clip in response_data['clips']]
-	else:
-		print(f"Failed to initiate custom song generation: {response.status_code} {response.text}")
+	if clip.status == 'streaming':
+		print("Song is streaming, starting progressive download.")
+		return clip
+	if clip.status != 'complete':
+		print(f"Song generation ended with status: {clip.status}")
 		return None
-
-def download_song(audio_url, filename, image_url, lyrics):
-	response = requests.get(audio_url)
-	if response.status_code == 200:
-		file_path = os.path.join("songs", filename)
-		with open(file_path, 'wb') as f:
-			f.write(response.content)
+	print("All song details are complete.")
+	return clip
+
+async def download_song(client, audio_url, filename, image_url, live=None):
+	# The cover art is fetched while the audio downloads; a live player gets the same bytes as the file
+	on_chunk = live.write if live else None
+	file_path, cover = await asyncio.gather(
+		client.download(audio_url, os.path.join("songs", filename), on_chunk=on_chunk),
+		client.fetch_cover(image_url),
+	)
+	if live:
+		live.close()
+	if file_path:
 		print(f"Song downloaded successfully: {file_path}")
-		add_album_art(file_path, image_url)
-		set_id3_tags(file_path, filename, lyrics)  # Directly use the modified title for ID3 tags
-		return file_path
-	else:
-		print("Failed to download the song:", response.status_code, response.text)
-		return None
-
-def add_album_art(mp3_file_path, image_url):
-	audio = MP3(mp3_file_path, ID3=ID3)
-	audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc=u'Cover', data=requests.get(image_url).content))
-	audio.save()
-	print(f"Album art added to {mp3_file_path}")
-
-def set_id3_tags(mp3_file_path, title, lyrics):
-	audio = MP3(mp3_file_path, ID3=ID3)
-	clean_title = title.replace('-', ' ').replace('.mp3', '')  # Remove dashes and extension from title
-	audio.tags.add(TIT2(encoding=3, text=clean_title))
-	audio.tags.add(USLT(encoding=3, lang=u'eng', desc=u'lyrics', text=lyrics))
-	audio.save()
-	print(f"ID3 tags set for {mp3_file_path}")
+	return file_path, cover
 
-def play_song_with_ffplay(file_paths, titles, description_prompts, lyrics, generated_with_file):
-	ffplay_path = r"C:\Program Files (x86)\ffmpeg\bin\ffplay.exe"
-	current_song_index = 0
-	current_process = None	# Initialize current process variable to keep track of the playing song
+def play_song_with_ffplay(playlist, generated_with_file):
+	def on_start(song):
+		file_path, title, description_prompt, lyrics, live = song
+		print_song_details(title, description_prompt, lyrics, generated_with_file)
 
-	def start_song(index):
-		nonlocal current_process
-		if current_process:
-			current_process.kill()	# Stop the currently playing song
-		current_process = subprocess.Popen([ffplay_path, "-autoexit", "-nodisp", "-loglevel", "quiet", file_paths[index]])
-		print_song_details(titles[index], description_prompts[index], lyrics[index], generated_with_file)
+	PlayerController(playlist, on_start).run()	# Returns once the last song has played
 
-	start_song(current_song_index)	# Start the first song initially
-
-	while True:
-		if keyboard.is_pressed('right') and current_song_index < len(file_paths) - 1:
-			current_song_index += 1
-			start_song(current_song_index)
-
-		elif keyboard.is_pressed('left') and current_song_index > 0:
-			current_song_index -= 1
-			start_song(current_song_index)
-
-		time.sleep(0.1)	 # Avoid high CPU usage
-		
 def print_song_details(title, description_prompt, lyrics, generated_with_file):
 	print(f"Playing song: {title}")
 	print(f"Title: {title}")
@@ -124,9 +57,59 @@ def print_song_details(title, description_prompt, lyrics, generated_with_file):
 		print(f"Description Prompt: {description_prompt}")
 	print(f"Lyrics: {lyrics}")
 
+async def process_clip(client, i, clip_id, download_slots, playlist, progressive):
+	clip = await wait_for_song(client, clip_id, progressive)
+	if not clip:
+		return
+	filename = f"{clip.title.replace(' ', '-')}-{i}.mp3"
+	streaming = clip.status == 'streaming'
+	live = None
+	if streaming:
+		audio_url = clip.audio_url
+		if len(playlist) == 0:
+			# Nothing is playing yet, so start the player on this clip's stream right away
+			live = LiveAudio(spawn_stdin_player())
+			playlist.add((os.path.join("songs", filename), clip.title, clip.description, clip.lyrics, live))
+	else:
+		audio_url = clip.cdn_audio_url
+
+	async with download_slots:
+		file_path, cover = await download_song(client, audio_url, filename, clip.image_url, live)
+	if not file_path:
+		return
+	if streaming:
+		# Final tags are written once the clip is complete
+		clip = await wait_for_song(client, clip_id) or clip
+	await asyncio.to_thread(write_tags, file_path, filename, clip.lyrics, cover)  # Directly use the modified title for ID3 tags
+	if live is None:
+		playlist.add((file_path, clip.title, clip.description, clip.lyrics, None))
+		print(f"Added to playlist: {clip.title}")
+
+async def run_pipeline(generate, playlist, progressive=False):
+	# generate(client) starts the generation; every clip is then watched and downloaded concurrently
+	# and joins the playlist as soon as it is ready
+	try:
+		async with SunoClient() as client:
+			print(f"Trace ID: {client.trace_id}")	# Sent with every proxy call of this run, so its proxy logs can be found
+			try:
+				clips = await generate(client)
+			except ProxyError as e:
+				print("Failed to initiate song generation:", e.status, e.detail)
+				return
+			if not clips:
+				print("Failed to generate song or retrieve clip IDs.")
+				return
+			print(f"Generated clips: {[clip.id for clip in clips]}")
+			print(f"Proxy timing: {client.server_timing}")
+			download_slots = asyncio.Semaphore(MAX_DOWNLOADS)
+			await asyncio.gather(*[process_clip(client, i, clip.id, download_slots, playlist, progressive) for i, clip in enumerate(clips, start=1)])
+	finally:
+		playlist.close()
+
 def main():
 	parser = argparse.ArgumentParser()
 	parser.add_argument("--file", help="Use lyrics from a file for custom song generation", action="store_true")
+	parser.add_argument("--progressive", help="Start playback while the first clip is still streaming", action="store_true")
 	args = parser.parse_args()
 
 	songs_dir = 'songs'
@@ -136,37 +119,22 @@ def main():
 		try:
 			with open('lyrics.txt', 'r') as file:
 				lyrics = file.read().strip()
-			genre = input("Enter the genre of the song: ")
-			title = input("Enter the title of the song: ")
-			clip_ids = initiate_custom_song_generation(lyrics, genre, title)
 		except FileNotFoundError:
 			print("lyrics.txt file not found.")
 			return
+		genre = input("Enter the genre of the song: ")
+		title = input("Enter the title of the song: ")
+		generate = lambda client: client.generate(lyrics, title, genre)
 	else:
 		description = input("Enter a description for the song you want to generate: ")
-		clip_ids = initiate_song_generation(description)
-
-	downloaded_files = []
-	if clip_ids:
-		for i, clip_id in enumerate(clip_ids, start=1):
-			song_details = fetch_song_details(clip_id)
-			if song_details:
-				filename = f"{song_details['title'].replace(' ', '-')}-{i}.mp3"
-				file_path = os.path.join(songs_dir, filename)
-				audio_url = get_audio_url_from_clip_id(clip_id)
-				if file_path := download_song(audio_url, filename, song_details.get('image_large_url', ''), song_details.get('metadata').get('prompt', '')):
-					downloaded_files.append((file_path, song_details['title'], song_details.get('metadata').get('gpt_description_prompt', ''), song_details.get('metadata').get('prompt', '')))
-	else:
-		print("Failed to generate song or retrieve clip IDs.")
-
-	if downloaded_files:
-		play_song_with_ffplay(
-			[df[0] for df in downloaded_files],
-			[df[1] for df in downloaded_files],
-			[df[2] for df in downloaded_files],
-			[df[3] for df in downloaded_files],
-			args.file
-		)
+		generate = lambda client: client.generate_description(description)
+
+	# Playback starts on the first finished clip while the others are still processing
+	playlist = Playlist()
+	player = threading.Thread(target=play_song_with_ffplay, args=(playlist, args.file), daemon=True)
+	player.start()
+	asyncio.run(run_pipeline(generate, playlist, args.progressive))
+	player.join()
 
 if __name__ == "__main__":
 	main()
@@ -1,11 +1,7 @@
 # -*- coding:utf-8 -*-
 
-from cookie import suno_auth
+from accounts import get_pool
 
 
-def get_token():
-    token = suno_auth.get_token()
-    try:
-        yield token
-    finally:
-        pass
+async def get_accounts():
+    yield get_pool()
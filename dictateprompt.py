@@ -1,17 +1,17 @@
-import os
-import requests
+import asyncio
+import argparse
 from dotenv import load_dotenv
-import pyaudio
-import wave
-import keyboard
-import openai
-import time
-import tempfile
+from client import generate_and_download
+from transcription import BACKENDS, OpenAIBackend, SegmentedTranscriber
+from vad import EnergyVAD, SilenceTrimmer
 
 # Load environment variables from .env file
 load_dotenv()
 
-def transcribe_audio_from_mic():
+def transcribe_audio_from_mic(hands_free=False, silence_timeout=2.0, vad_threshold=500, backend=None):
+	import pyaudio	# Imported on first use, only recording needs them
+	import keyboard
+
 	FORMAT = pyaudio.paInt16
 	CHANNELS = 1
 	RATE = 16000
@@ -23,98 +23,53 @@ def transcribe_audio_from_mic():
 	stream = audio.open(format=FORMAT, channels=CHANNELS,
 						rate=RATE, input=True,
 						frames_per_buffer=CHUNK)
-	print("Recording... Press Enter to stop.")
+	if hands_free:
+		print(f"Recording... Stops after {silence_timeout}s of silence or when Enter is pressed.")
+	else:
+		print("Recording... Press Enter to stop.")
 
-	frames = []
+	# Each chunk is compressed as soon as it is read and silence is trimmed before it reaches the encoder;
+	# finished segments are transcribed in the background while recording continues
+	transcriber = SegmentedTranscriber(backend or OpenAIBackend(), RATE, CHANNELS, CHUNK / RATE)
+	trimmer = SilenceTrimmer(transcriber, EnergyVAD(vad_threshold), CHUNK / RATE)
 
 	while True:
 		data = stream.read(CHUNK)
-		frames.append(data)
+		trimmer.write(data)
 		if keyboard.is_pressed('enter'):
 			print("Stop recording.")
 			break
+		if hands_free and trimmer.heard_speech and trimmer.trailing_silence >= silence_timeout:
+			print("Silence detected, stop recording.")
+			break
 
 	# Stop and close the stream
 	stream.stop_stream()
 	stream.close()
 	audio.terminate()
 
-	# Create a temporary file to save the recorded data
-	temp_wav = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-	print(f"Temporary file created at: {temp_wav.name}")
-
-	wf = wave.open(temp_wav.name, 'wb')
-	wf.setnchannels(CHANNELS)
-	wf.setsampwidth(audio.get_sample_size(FORMAT))
-	wf.setframerate(RATE)
-	wf.writeframes(b''.join(frames))
-	wf.close()
-
-	# Transcribe the audio file using OpenAI's Whisper model
-	openai.api_key = os.getenv("OPENAI_API_KEY")
-	with open(temp_wav.name, "rb") as audio_file:
-		transcription_response = openai.audio.transcriptions.create(
-			model="whisper-1",
-			file=audio_file,
-			language="en"
-		)
-	if hasattr(transcription_response, 'text'):
-		transcription = transcription_response.text
-	else:
-		transcription = transcription_response['choices'][0]['text']
+	transcription = trimmer.finish()
+	if not trimmer.heard_speech:
+		print("No speech detected.")
+		return ""
 	print("Transcription response:", transcription)
 
 	return transcription
 
-def get_audio_url_from_clip_id(clip_id):
-	audio_url = f"https://cdn1.suno.ai/{clip_id}.mp3"
-	print(f"Constructed Audio URL: {audio_url}")
-	return audio_url
-
-def initiate_song_generation(description):
-	url = "http://127.0.0.1:8000/generate/description-mode"
-	headers = {
-		'Cookie': f'session_id={os.getenv("SESSION_ID")}; {os.getenv("COOKIE")}'
-	}
-	data = {
-		"gpt_description_prompt": description,
-		"make_instrumental": False,
-		"mv": "chirp-v3-0"
-	}
-	response = requests.post(url, json=data, headers=headers)
-	if response.status_code == 200:
-		response_data = response.json()
-		print("Response Data from Generation:", response_data)
-		return [clip['id'] for clip in response_data['clips']]
-	else:
-		print("Failed to initiate song generation:", response.status_code, response.text)
-		return None
-
-def download_song(audio_url):
-	headers = {
-		'Cookie': f'session_id={os.getenv("SESSION_ID")}; {os.getenv("COOKIE")}'
-	}
-	response = requests.get(audio_url, headers=headers)
-	if response.status_code == 200:
-		filename = audio_url.split('/')[-1]
-		with open(filename, 'wb') as f:
-			f.write(response.content)
-		print(f"Song downloaded successfully: {filename}")
-	else:
-		print("Failed to download the song:", response.status_code, response.text)
-
 def main():
-	transcription = transcribe_audio_from_mic()
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--hands-free", help="Stop recording automatically after a period of silence", action="store_true")
+	parser.add_argument("--silence-timeout", help="Seconds of silence that end a hands-free recording", type=float, default=2.0)
+	parser.add_argument("--vad-threshold", help="RMS level above which audio counts as speech", type=int, default=500)
+	parser.add_argument("--backend", help="Transcription backend", choices=sorted(BACKENDS), default="openai")
+	args = parser.parse_args()
+
+	transcription = transcribe_audio_from_mic(args.hands_free, args.silence_timeout, args.vad_threshold, BACKENDS[args.backend]())
+	if not transcription:
+		print("Nothing to generate from.")
+		return
 	print(f"Transcribed prompt: {transcription}")
-	clip_ids = initiate_song_generation(transcription)
-	if clip_ids:
-		print("Waiting for the song to be processed...")
-		time.sleep(120)	# Waiting for processing
-		for clip_id in clip_ids:
-			audio_url = get_audio_url_from_clip_id(clip_id)
-			download_song(audio_url)
-	else:
-		print("Failed to generate song or retrieve clip IDs.")
+	asyncio.run(generate_and_download(transcription))
 
 if __name__ == "__main__":
 	main()
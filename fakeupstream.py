@@ -0,0 +1,199 @@
+# -*- coding:utf-8 -*-
+
+import argparse
+import asyncio
+import base64
+import json
+import re
+import time
+import uuid
+from collections import Counter
+
+from aiohttp import web
+
+# seconds after submission at which a fake clip moves to each status
+DEFAULT_TIMELINE = (("submitted", 0), ("queued", 2), ("streaming", 5), ("complete", 15))
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def make_jwt(ttl, sid=""):
+    claims = {"exp": int(time.time() + ttl), "sid": sid}
+    return f"{_b64({'alg': 'none'})}.{_b64(claims)}.fake"
+
+
+def _session_of(request):
+    # the session id the proxy's bearer token was issued for
+    token = request.headers.get("Authorization", "")[len("Bearer ") :]
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))["sid"]
+    except (IndexError, KeyError, ValueError):
+        return ""
+
+
+class FakeSuno:
+    """In-memory stand-in for the Clerk token endpoint and the Suno API."""
+
+    def __init__(
+        self, latency=0.02, timeline=DEFAULT_TIMELINE, token_ttl=60, credits=10**6
+    ):
+        self.latency = latency
+        self.timeline = timeline
+        self.token_ttl = token_ttl
+        self.initial_credits = credits
+        self.credits = {}  # per session id
+        self.rate_limited = set()  # session ids whose generations get a 429
+        self.token_status = 200  # set to e.g. 502 or 401 to make token refreshes fail
+        self.clips = {}
+        self.lyrics = {}
+        self.calls = Counter()
+        self.generations = Counter()  # generation attempts per session id
+        self.audio_bytes = bytes(range(256)) * 1024
+
+    def _clip_view(self, clip):
+        elapsed = time.time() - clip["created"]
+        status = self.timeline[0][0]
+        for name, after in self.timeline:
+            if elapsed >= after:
+                status = name
+        audio_url = ""
+        if status == "streaming":
+            audio_url = f"https://audiopipe.suno.ai/?item_id={clip['id']}"
+        elif status == "complete":
+            audio_url = f"https://cdn1.suno.ai/{clip['id']}.mp3"
+        return {
+            "id": clip["id"],
+            "title": clip["title"],
+            "status": status,
+            "audio_url": audio_url,
+            "image_large_url": f"https://cdn1.suno.ai/image_large_{clip['id']}.png",
+            "metadata": clip["metadata"],
+        }
+
+    async def _delay(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def token(self, request):
+        await self._delay("token")
+        if self.token_status != 200:
+            return web.json_response({"errors": []}, status=self.token_status)
+        sid = request.match_info["sid"]
+        resp = web.json_response({"jwt": make_jwt(self.token_ttl, sid)})
+        resp.set_cookie("__client", uuid.uuid4().hex)
+        return resp
+
+    async def generate(self, request):
+        await self._delay("generate")
+        sid = _session_of(request)
+        self.generations[sid] += 1
+        if sid in self.rate_limited:
+            return web.json_response(
+                {"detail": "rate limited"}, status=429, headers={"Retry-After": "30"}
+            )
+        credits = self.credits.setdefault(sid, self.initial_credits)
+        if credits < 10:
+            return web.json_response({"detail": "out of credits"}, status=402)
+        self.credits[sid] = credits - 10
+        data = json.loads(await request.text() or "{}")
+        clips = []
+        for _ in range(2):
+            clip = {
+                "id": str(uuid.uuid4()),
+                "title": data.get("title") or "Fake Song",
+                "created": time.time(),
+                "metadata": {
+                    "prompt": data.get("prompt", ""),
+                    "gpt_description_prompt": data.get("gpt_description_prompt", ""),
+                    "tags": data.get("tags", ""),
+                },
+            }
+            self.clips[clip["id"]] = clip
+            clips.append(self._clip_view(clip))
+        return web.json_response({"id": str(uuid.uuid4()), "clips": clips})
+
+    async def feed(self, request):
+        await self._delay("feed")
+        ids = [i for i in request.query.get("ids", "").split(",") if i]
+        return web.json_response(
+            [self._clip_view(self.clips[i]) for i in ids if i in self.clips]
+        )
+
+    async def generate_lyrics(self, request):
+        await self._delay("generate_lyrics")
+        data = json.loads(await request.text() or "{}")
+        lid = str(uuid.uuid4())
+        self.lyrics[lid] = data.get("prompt", "")
+        return web.json_response({"id": lid})
+
+    async def get_lyrics(self, request):
+        await self._delay("get_lyrics")
+        lid = request.match_info["lid"]
+        if lid not in self.lyrics:
+            return web.json_response({"detail": "not found"}, status=404)
+        return web.json_response(
+            {"status": "complete", "title": "Fake Lyrics", "text": "[Verse]\nla la la"}
+        )
+
+    async def audio(self, request):
+        # stands in for cdn1.suno.ai, with Range support for resumed downloads
+        await self._delay("audio")
+        data = self.audio_bytes
+        match = re.match(r"bytes=(\d+)-", request.headers.get("Range", ""))
+        if not match:
+            return web.Response(body=data, content_type="audio/mpeg")
+        start = int(match.group(1))
+        if start >= len(data):
+            return web.Response(status=416)
+        return web.Response(
+            body=data[start:],
+            status=206,
+            headers={"Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}"},
+            content_type="audio/mpeg",
+        )
+
+    async def billing(self, request):
+        await self._delay("billing")
+        sid = _session_of(request)
+        return web.json_response(
+            {"total_credits_left": self.credits.get(sid, self.initial_credits)}
+        )
+
+    async def stats(self, request):
+        return web.json_response(dict(self.calls))
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/client/sessions/{sid}/tokens", self.token)
+        app.router.add_post("/api/generate/v2/", self.generate)
+        app.router.add_get("/api/feed/", self.feed)
+        app.router.add_post("/api/generate/lyrics/", self.generate_lyrics)
+        app.router.add_get("/api/generate/lyrics/{lid}", self.get_lyrics)
+        app.router.add_get("/api/billing/info/", self.billing)
+        app.router.add_get("/stats", self.stats)
+        app.router.add_get("/{clip_id}.mp3", self.audio)
+        return app
+
+
+async def start(fake, host="127.0.0.1", port=0):
+    """Serve `fake` in the running loop; returns (runner, base_url)."""
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for Suno and Clerk")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+    print(f"Point BASE_URL and CLERK_URL at http://127.0.0.1:{args.port}")
+    web.run_app(FakeSuno(args.latency).app(), host="127.0.0.1", port=args.port)
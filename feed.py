@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+
+import asyncio
+import os
+
+from accounts import get_pool
+from cache import FeedCache
+from tracing import span
+from utils import get_feed
+
+FEED_BATCH_WINDOW = float(os.getenv("FEED_BATCH_WINDOW", "0.05"))
+FEED_BATCH_MAX = int(os.getenv("FEED_BATCH_MAX", "50"))
+
+
+class FeedCoalescer:
+    """Collects clip lookups for a short window and fetches them in one upstream call."""
+
+    def __init__(self, window=FEED_BATCH_WINDOW, max_batch=FEED_BATCH_MAX):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._inflight = {}
+        self._timers = {}
+
+    async def get(self, ids, token):
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.setdefault(token, {})
+        futures = []
+        for clip_id in ids:
+            pending = self._pending.setdefault(token, {})
+            fut = pending.get(clip_id) or inflight.get(clip_id)
+            if fut is None:
+                fut = loop.create_future()
+                pending[clip_id] = fut
+                # a full batch goes out at once, so no upstream call carries more than max_batch ids
+                if len(pending) >= self.max_batch:
+                    self._flush(token)
+            futures.append(fut)
+
+        pending = self._pending.get(token)
+        if not pending:
+            self._pending.pop(token, None)
+        elif token not in self._timers:
+            self._timers[token] = loop.call_later(self.window, self._flush, token)
+
+        # shield so one cancelled caller does not cancel a lookup others share
+        return await asyncio.gather(*[asyncio.shield(f) for f in futures])
+
+    def _flush(self, token):
+        timer = self._timers.pop(token, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(token, None)
+        if not batch:
+            return
+        self._inflight.setdefault(token, {}).update(batch)
+        asyncio.ensure_future(self._run(token, batch))
+
+    async def _run(self, token, batch):
+        try:
+            resp = await get_feed(",".join(batch), token)
+            if not isinstance(resp, list):
+                raise Exception(resp)
+            clips = {clip.get("id"): clip for clip in resp}
+            for clip_id, fut in batch.items():
+                if not fut.done():
+                    fut.set_result(clips.get(clip_id))
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+        finally:
+            inflight = self._inflight.get(token, {})
+            for clip_id, fut in batch.items():
+                if inflight.get(clip_id) is fut:
+                    del inflight[clip_id]
+            if not inflight and not self._pending.get(token):
+                self._inflight.pop(token, None)
+
+
+feed_coalescer = FeedCoalescer()
+feed_cache = FeedCache()
+
+
+def parse_ids(ids):
+    return [i.strip() for i in ids.split(",") if i.strip()]
+
+
+async def _lookup(account, ids):
+    return await feed_coalescer.get(ids, await account.get_token())
+
+
+async def fetch_clips(ids):
+    """Clip records for `ids`, each looked up through the account that generated it."""
+    found = {}
+    missing = []
+    for clip_id in ids:
+        clip = feed_cache.get(clip_id)
+        if clip is None:
+            missing.append(clip_id)
+        else:
+            found[clip_id] = clip
+
+    if missing:
+        groups = await get_pool().group_by_owner(missing)
+        with span("feed_lookup", cached=len(found), missing=len(missing)):
+            results = await asyncio.gather(
+                *[_lookup(account, group) for account, group in groups.items()]
+            )
+        for clip in (clip for clips in results for clip in clips):
+            if clip is not None:
+                feed_cache.put(clip)
+                found[clip["id"]] = clip
+
+    return [found[i] for i in ids if i in found]
@@ -1,7 +1,7 @@
 import os
 import requests
 from dotenv import load_dotenv
-import time
+from polling import Poller
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,26 +12,28 @@ def poll_for_audio_url(song_id, timeout=600, interval=30):
 	headers = {
 		"Cookie": f"session_id={os.getenv('SESSION_ID')}; {os.getenv('COOKIE')}"
 	}
-	start_time = time.time()
 
-	while time.time() - start_time < timeout:
-		response = requests.get(api_url, headers=headers)
-		if response.status_code == 200:
-			data = response.json()
-			print("Checking feed data:", data)
-			# Assuming 'audio_url' becomes available in the response JSON at some point
-			if 'audio_url' in data and data['audio_url']:
-				return data['audio_url']
-			else:
-				print("Audio URL not yet available, re-checking in", interval, "seconds...")
-		else:
-			print("Failed to retrieve feed data. Status Code:", response.status_code)
-			print("Response:", response.text)
+	def check():
+		response = requests.get(api_url, headers=headers, timeout=30)
+		if response.status_code != 200:
+			raise Exception(f"Failed to retrieve feed data. Status Code: {response.status_code} Response: {response.text}")
+		data = response.json()
+		data = data[0] if isinstance(data, list) else data
+		print("Checking feed data:", data)
+		# Assuming 'audio_url' becomes available in the response JSON at some point
+		if 'audio_url' in data and data['audio_url']:
+			return 'complete', data['audio_url']
+		print("Audio URL not yet available, status:", data.get('status'))
+		return data.get('status'), None
 
-		time.sleep(interval)
-
-	print("Timeout reached without retrieving audio URL.")
-	return None
+	poller = Poller(default_interval=interval, deadline=timeout)
+	try:
+		return poller.run(check)
+	except TimeoutError:
+		print("Timeout reached without retrieving audio URL.")
+		return None
+	finally:
+		print("Polling stats:", poller.summary())
 
 def main():
 	song_id = input("Enter the song ID to fetch details: ")
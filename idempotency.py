@@ -0,0 +1,159 @@
+# -*- coding:utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from resilience import UpstreamError
+from tokenstore import get_store
+from tracing import get_logger
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX = int(os.getenv("IDEMPOTENCY_MAX", "10000"))
+# identical generate payloads within this many seconds share one generation; 0 turns it off
+GENERATE_DEDUP_WINDOW = float(os.getenv("GENERATE_DEDUP_WINDOW", "0"))
+# a generation another worker claimed this long ago without finishing is assumed lost
+IDEMPOTENCY_PENDING_TIMEOUT = float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT", "300"))
+IDEMPOTENCY_POLL = 0.2
+
+log = get_logger("idempotency")
+
+
+class IdempotencyConflict(UpstreamError):
+    def __init__(self):
+        super().__init__(422, "Idempotency-Key was already used for a different request")
+
+
+def fingerprint(scope, payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{scope}\0{canonical}".encode()).hexdigest()
+
+
+class GenerateDeduplicator:
+    """Answers a repeated generate request with the first one's response instead of generating again.
+
+    Requests are matched by their Idempotency-Key header, or by payload when
+    `dedup_window` is set. A duplicate that arrives while the first request is
+    still generating waits for it. Results are kept in memory and, when a token
+    store is configured, shared with the other workers through it.
+    """
+
+    def __init__(
+        self,
+        ttl=IDEMPOTENCY_TTL,
+        max_entries=IDEMPOTENCY_MAX,
+        dedup_window=GENERATE_DEDUP_WINDOW,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.dedup_window = dedup_window
+        self._results = OrderedDict()  # key -> (expires_at, fingerprint, body)
+        self._inflight = {}  # key -> (fingerprint, task)
+        self.replays = 0
+
+    async def run(self, scope, payload, idempotency_key, call):
+        """(body, replayed) for `call()`, which is only awaited if no earlier result matches."""
+        digest = fingerprint(scope, payload)
+        if idempotency_key:
+            key, ttl = f"{scope}:key:{idempotency_key}", self.ttl
+        elif self.dedup_window > 0:
+            key, ttl = f"{scope}:content:{digest}", self.dedup_window
+        else:
+            return await call(), False
+
+        result = self._local(key, digest)
+        if result is not None:
+            self.replays += 1
+            return result, True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            if inflight[0] != digest:
+                raise IdempotencyConflict()
+            replayed = True
+            task = inflight[1]
+        else:
+            replayed = False
+            # a task of its own, so a client that disconnects does not abandon a generation its retry will want
+            task = asyncio.ensure_future(self._execute(key, digest, ttl, call))
+            self._inflight[key] = (digest, task)
+        body, stored = await asyncio.shield(task)
+        replayed = replayed or stored
+        if replayed:
+            self.replays += 1
+        return body, replayed
+
+    def _local(self, key, digest):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires_at, entry_digest, body = entry
+        if expires_at <= time.time():
+            del self._results[key]
+            return None
+        if entry_digest != digest:
+            raise IdempotencyConflict()
+        return body
+
+    def _remember(self, key, digest, body, ttl):
+        self._results[key] = (time.time() + ttl, digest, body)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    async def _execute(self, key, digest, ttl, call):
+        try:
+            store = get_store()
+            if store is None:
+                body, stored = await call(), False
+            else:
+                body, stored = await self._execute_shared(store, key, digest, ttl, call)
+            self._remember(key, digest, body, ttl)
+            return body, stored
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _execute_shared(self, store, key, digest, ttl, call):
+        try:
+            while True:
+                state, body = await asyncio.to_thread(
+                    store.claim_result, key, digest, IDEMPOTENCY_PENDING_TIMEOUT
+                )
+                if state == "done":
+                    return body, True
+                if state == "conflict":
+                    raise IdempotencyConflict()
+                if state == "claimed":
+                    break
+                # another worker is generating it
+                await asyncio.sleep(IDEMPOTENCY_POLL)
+        except sqlite3.Error as e:
+            log.warning("result_store_failed", error=str(e))
+            return await call(), False
+
+        try:
+            body = await call()
+        except BaseException:
+            await asyncio.to_thread(store.drop_result, key)
+            raise
+        try:
+            await asyncio.to_thread(
+                store.finish_result, key, body, time.time() + ttl, self.max_entries
+            )
+        except sqlite3.Error as e:
+            log.warning("result_store_failed", error=str(e))
+        return body, False
+
+    def stats(self):
+        return {
+            "replays": self.replays,
+            "size": len(self._results),
+            "in_flight": len(self._inflight),
+        }
+
+
+generate_dedup = GenerateDeduplicator()
@@ -0,0 +1,65 @@
+#Usage: python importbench.py [--repeat 3] [--budget-ms 500] [module ...]
+#Measures the cold import time of each program in a fresh interpreter and names its heaviest imports
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODULES = ["cli", "main", "customprompt", "manualprompt", "dictateprompt", "batch", "getdetails"]
+LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+def measure(module, repeat):
+	# Returns (best wall seconds, import microseconds, [(microseconds, name)] of its direct imports)
+	wall = []
+	for _ in range(repeat):
+		started = time.perf_counter()
+		result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, capture_output=True, text=True)
+		wall.append(time.perf_counter() - started)
+		if result.returncode != 0:
+			raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+	cumulative, direct, pending = 0, [], []
+	for line in result.stderr.splitlines():
+		match = LINE_RE.match(line)
+		if not match:
+			continue
+		depth = len(match.group(3)) // 2
+		if depth == 0:
+			if match.group(4) == module:
+				cumulative, direct = int(match.group(2)), pending
+			pending = []
+		elif depth == 1:
+			pending.append((int(match.group(2)), match.group(4)))
+	return min(wall), cumulative, sorted(direct, reverse=True)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("modules", nargs="*", help="Modules to measure", default=MODULES)
+	parser.add_argument("--repeat", help="Runs per module, the fastest counts", type=int, default=3)
+	parser.add_argument("--budget-ms", help="Fail when a module takes longer than this to import", type=float)
+	parser.add_argument("--top", help="Heaviest direct imports to list", type=int, default=3)
+	args = parser.parse_args()
+
+	baseline, _, _ = measure("sys", args.repeat)
+	print(f"Interpreter startup: {baseline * 1000:.0f} ms")
+	over = []
+	for module in args.modules:
+		try:
+			wall, cumulative, direct = measure(module, args.repeat)
+		except RuntimeError as e:
+			print(f"{module:<14} failed to import: {e}")
+			over.append(module)
+			continue
+		heaviest = ", ".join(f"{name} {us / 1000:.0f}" for us, name in direct[:args.top])
+		print(f"{module:<14} import {cumulative / 1000:>6.0f} ms  process {wall * 1000:>6.0f} ms  heaviest: {heaviest}")
+		if args.budget_ms is not None and cumulative / 1000 > args.budget_ms:
+			over.append(module)
+	if over:
+		print(f"Over budget: {', '.join(over)}")
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -1,15 +1,63 @@
 # -*- coding:utf-8 -*-
 
-import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 
+import codec
 import schemas
-from deps import get_token
-from utils import generate_lyrics, generate_music, get_feed, get_lyrics
+from accounts import AccountPool, get_pool, init_accounts
+from deps import get_accounts
+from feed import feed_cache, fetch_clips, parse_ids
+from idempotency import generate_dedup
+from metrics import CallbackGauge, MetricsMiddleware, registry
+from resilience import UpstreamError
+from tracing import TraceMiddleware, start_logging, stop_logging
+from utils import (
+    close_session,
+    get_lyrics,
+    init_session,
+    policies,
+    set_token_refresher,
+)
+from watcher import watch
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
 
-app = FastAPI()
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+    await init_session()
+    set_token_refresher(init_accounts().refresh_token)
+    try:
+        yield
+    finally:
+        await close_session()
+        stop_logging()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=codec.FastJSONResponse)
 
 
 app.add_middleware(
@@ -19,6 +67,108 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# brotli when brotli-asgi is installed and the client accepts it, gzip otherwise; event streams are left alone
+if BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESS_MIN_SIZE,
+        excluded_handlers=["/feed/stream"],
+    )
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_SIZE)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TraceMiddleware)
+
+for name, doc, func, kind in (
+    (
+        "suno_token_age_seconds",
+        "Seconds since the session token was last refreshed",
+        lambda a: a.tokens.refreshed_at and time.time() - a.tokens.refreshed_at,
+        "gauge",
+    ),
+    (
+        "suno_token_expires_in_seconds",
+        "Seconds until the current session token expires",
+        lambda a: a.tokens.expires_at and a.tokens.expires_at - time.time(),
+        "gauge",
+    ),
+    (
+        "suno_token_refreshes_total",
+        "Session token refreshes",
+        lambda a: a.tokens.refresh_count,
+        "counter",
+    ),
+    ("suno_account_credits", "Credits left on the account", lambda a: a.credits, "gauge"),
+    (
+        "suno_account_in_flight",
+        "Generations in flight on the account",
+        lambda a: a.in_flight,
+        "gauge",
+    ),
+    (
+        "suno_account_ejected",
+        "1 while the account is ejected from the pool",
+        lambda a: int(a.ejected),
+        "gauge",
+    ),
+):
+    registry.register(
+        CallbackGauge(
+            name,
+            doc,
+            lambda func=func: {(a.name,): func(a) for a in get_pool().accounts},
+            labelnames=("account",),
+            kind=kind,
+        )
+    )
+for name, stat, kind in (
+    ("feed_cache_hits_total", "hits", "counter"),
+    ("feed_cache_misses_total", "misses", "counter"),
+    ("feed_cache_evictions_total", "evictions", "counter"),
+    ("feed_cache_size", "size", "gauge"),
+):
+    registry.register(
+        CallbackGauge(
+            name,
+            f"Feed cache {stat}",
+            lambda stat=stat: feed_cache.stats()[stat],
+            kind=kind,
+        )
+    )
+for name, stat, kind in (
+    ("generate_replays_total", "replays", "counter"),
+    ("generate_results_size", "size", "gauge"),
+    ("generate_dedup_in_flight", "in_flight", "gauge"),
+):
+    registry.register(
+        CallbackGauge(
+            name,
+            f"Generate deduplication {stat}",
+            lambda stat=stat: generate_dedup.stats()[stat],
+            kind=kind,
+        )
+    )
+registry.register(
+    CallbackGauge(
+        "upstream_circuit_open",
+        "1 while the circuit breaker for an upstream endpoint class is open",
+        lambda: {(k,): int(p.breaker.state != "closed") for k, p in policies.items()},
+        labelnames=("target",),
+    )
+)
+
+
+def passthrough(body: bytes, replayed: bool = False):
+    """Hand an upstream JSON body to the client as is, without decoding it."""
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def upstream_http_error(e: UpstreamError):
+    headers = None
+    if e.retry_after is not None:
+        headers = {"Retry-After": str(int(e.retry_after))}
+    return HTTPException(detail=e.detail, status_code=e.status_code, headers=headers)
 
 
 @app.get("/")
@@ -26,13 +176,27 @@ async def get_root():
     return schemas.Response()
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.post("/generate")
 async def generate(
-    data: schemas.CustomModeGenerateParam, token: str = Depends(get_token)
+    data: schemas.CustomModeGenerateParam,
+    accounts: AccountPool = Depends(get_accounts),
+    idempotency_key: Optional[str] = Header(None),
 ):
     try:
-        resp = await generate_music(data.dict(), token)
-        return resp
+        payload = data.dict()
+        resp, replayed = await generate_dedup.run(
+            "generate", payload, idempotency_key, lambda: accounts.generate(payload)
+        )
+        return passthrough(resp, replayed)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(
             detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -41,22 +205,71 @@ async def generate(
 
 @app.post("/generate/description-mode")
 async def generate_with_song_description(
-    data: schemas.DescriptionModeGenerateParam, token: str = Depends(get_token)
+    data: schemas.DescriptionModeGenerateParam,
+    accounts: AccountPool = Depends(get_accounts),
+    idempotency_key: Optional[str] = Header(None),
 ):
     try:
-        resp = await generate_music(data.dict(), token)
+        payload = data.dict()
+        resp, replayed = await generate_dedup.run(
+            "description-mode",
+            payload,
+            idempotency_key,
+            lambda: accounts.generate(payload),
+        )
+        return passthrough(resp, replayed)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
+    except Exception as e:
+        raise HTTPException(
+            detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+
+@app.get("/feed")
+async def fetch_feed_bulk(ids: str):
+    try:
+        resp = await fetch_clips(parse_ids(ids))
         return resp
+    except UpstreamError as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(
             detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
 
+@app.get("/feed/stream")
+async def stream_feed(ids: str):
+    async def events():
+        async for event, data in watch(parse_ids(ids)):
+            yield f"event: {event}\ndata: {codec.dumps(data).decode()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@app.websocket("/feed/ws")
+async def stream_feed_ws(websocket: WebSocket, ids: str):
+    await websocket.accept()
+    try:
+        async for event, data in watch(parse_ids(ids)):
+            await websocket.send_text(codec.dumps({"event": event, "data": data}).decode())
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
 @app.get("/feed/{aid}")
-async def fetch_feed(aid: str, token: str = Depends(get_token)):
+async def fetch_feed(aid: str):
     try:
-        resp = await get_feed(aid, token)
+        resp = await fetch_clips(parse_ids(aid))
         return resp
+    except UpstreamError as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(
             detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -64,7 +277,9 @@ async def fetch_feed(aid: str, token: str = Depends(get_token)):
 
 
 @app.post("/generate/lyrics/")
-async def generate_lyrics_post(request: Request, token: str = Depends(get_token)):
+async def generate_lyrics_post(
+    request: Request, accounts: AccountPool = Depends(get_accounts)
+):
     req = await request.json()
     prompt = req.get("prompt")
     if prompt is None:
@@ -73,8 +288,10 @@ async def generate_lyrics_post(request: Request, token: str = Depends(get_token)
         )
 
     try:
-        resp = await generate_lyrics(prompt, token)
-        return resp
+        resp = await accounts.generate_lyrics(prompt)
+        return passthrough(resp)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(
             detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -82,10 +299,12 @@ async def generate_lyrics_post(request: Request, token: str = Depends(get_token)
 
 
 @app.get("/lyrics/{lid}")
-async def fetch_lyrics(lid: str, token: str = Depends(get_token)):
+async def fetch_lyrics(lid: str, accounts: AccountPool = Depends(get_accounts)):
     try:
-        resp = await get_lyrics(lid, token)
-        return resp
+        resp = await get_lyrics(lid, await accounts.token_for(lid), raw=True)
+        return passthrough(resp)
+    except UpstreamError as e:
+        raise upstream_http_error(e)
     except Exception as e:
         raise HTTPException(
             detail=str(e), status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -0,0 +1,181 @@
+# -*- coding:utf-8 -*-
+
+import bisect
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def header(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        return [
+            f"{self.name}{_labels(self.labelnames, k)} {v}"
+            for k, v in self.values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, value, *labelvalues):
+        self.values[labelvalues] = value
+
+
+class CallbackGauge(Metric):
+    """Gauge (or counter) whose samples come from a function called at scrape time."""
+
+    def __init__(self, name, documentation, func, labelnames=(), kind="gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+        self.kind = kind
+
+    def collect(self):
+        value = self.func()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [
+            f"{self.name}{_labels(self.labelnames, k)} {v}"
+            for k, v in value.items()
+            if v is not None
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, *labelvalues):
+        series = self.values.get(labelvalues)
+        if series is None:
+            series = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def collect(self):
+        lines = []
+        for k, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = _labels(self.labelnames, k, [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, k)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, k)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            samples = metric.collect()
+            if samples:
+                lines += metric.header() + samples
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter(
+        "http_requests_total",
+        "Requests handled by the proxy",
+        ("method", "route", "status"),
+    )
+)
+http_latency = registry.register(
+    Histogram(
+        "http_request_duration_seconds", "Proxy request latency", ("method", "route")
+    )
+)
+http_in_flight = registry.register(
+    Gauge("http_requests_in_flight", "Requests currently being handled by the proxy")
+)
+upstream_requests = registry.register(
+    Counter("upstream_requests_total", "Calls made to the Suno API", ("target", "status"))
+)
+upstream_latency = registry.register(
+    Histogram(
+        "upstream_request_duration_seconds", "Suno API call latency", ("target",)
+    )
+)
+upstream_in_flight = registry.register(
+    Gauge("upstream_requests_in_flight", "Suno API calls currently open", ("target",))
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route counts, latency and in-flight requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            # the router stores the matched route in the scope, which keeps path parameters out of the labels
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_requests.inc(scope["method"], route, status_code)
+            http_latency.observe(time.perf_counter() - start, scope["method"], route)
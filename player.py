@@ -0,0 +1,180 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+DEFAULT_WINDOWS_PATH = r"C:\Program Files (x86)\ffmpeg\bin\ffplay.exe"
+PLAYER_ARGS = ["-autoexit", "-nodisp", "-loglevel", "quiet"]
+CHUNK_SIZE = 64 * 1024
+
+def find_ffplay():
+	# FFPLAY_PATH wins, then ffplay on PATH, then the default Windows install location
+	path = os.getenv("FFPLAY_PATH") or shutil.which("ffplay")
+	if path:
+		return path
+	if os.path.exists(DEFAULT_WINDOWS_PATH):
+		return DEFAULT_WINDOWS_PATH
+	raise FileNotFoundError("ffplay not found: install ffmpeg or set FFPLAY_PATH")
+
+def spawn_stdin_player(ffplay_path=None):
+	# A player reading from stdin starts up (process launch, codec and audio init) before it has data
+	return subprocess.Popen([ffplay_path or find_ffplay(), *PLAYER_ARGS, "pipe:0"], stdin=subprocess.PIPE)
+
+class Playlist:
+	# Songs are appended by the download pipeline while the player is already running.
+	# Each song is a tuple whose first item is the file path and last item a LiveAudio or None
+	def __init__(self):
+		self.songs = []
+		self.closed = False
+		self.listeners = []
+		self._cond = threading.Condition()
+
+	def __len__(self):
+		with self._cond:
+			return len(self.songs)
+
+	def __getitem__(self, index):
+		with self._cond:
+			return self.songs[index]
+
+	def _notify(self):
+		self._cond.notify_all()
+		for listener in self.listeners:
+			listener()
+
+	def add(self, song):
+		with self._cond:
+			self.songs.append(song)
+			self._notify()
+
+	def close(self):
+		with self._cond:
+			self.closed = True
+			self._notify()
+
+	def wait_for(self, index):
+		# Blocks until song `index` is available; False if the pipeline finished without it
+		with self._cond:
+			self._cond.wait_for(lambda: len(self.songs) > index or self.closed)
+			return len(self.songs) > index
+
+class LiveAudio:
+	# Feeds a clip to a player reading stdin while the clip is still being downloaded
+	def __init__(self, process):
+		self.process = process
+
+	def write(self, chunk):
+		if self.process is None:
+			return
+		try:
+			self.process.stdin.write(chunk)
+		except (BrokenPipeError, OSError, ValueError):
+			self.process = None	# The player was stopped or skipped to another song
+
+	def close(self):
+		if self.process is not None:
+			try:
+				self.process.stdin.close()
+			except (BrokenPipeError, OSError):
+				pass
+
+def _feed(process, file_path):
+	try:
+		with open(file_path, 'rb') as f:
+			shutil.copyfileobj(f, process.stdin, CHUNK_SIZE)
+	except (BrokenPipeError, OSError, ValueError):
+		pass	# The player was stopped before the file was fully sent
+	finally:
+		try:
+			process.stdin.close()
+		except (BrokenPipeError, OSError):
+			pass
+
+class PlayerController:
+	# Plays a Playlist in order, reacting to key events and player exits instead of polling.
+	# The next song's player is started ahead of time so skipping to it is immediate
+	def __init__(self, playlist, on_start=None, ffplay_path=None):
+		self.playlist = playlist
+		self.on_start = on_start
+		self.ffplay_path = ffplay_path or find_ffplay()
+		self.events = queue.Queue()
+		self.index = None
+		self.process = None
+		self.preloaded = None
+		self.waiting = False	# The last song ended and more may still arrive
+
+	def _watch(self, process):
+		threading.Thread(target=lambda: (process.wait(), self.events.put(('finished', process))), daemon=True).start()
+
+	def _stop(self, process):
+		if process is not None and process.poll() is None:
+			process.kill()
+
+	def _preload(self, index):
+		if self.preloaded and self.preloaded[0] == index:
+			return
+		if self.preloaded:
+			self._stop(self.preloaded[1])
+			self.preloaded = None
+		if index < len(self.playlist) and self.playlist[index][-1] is None:
+			self.preloaded = (index, spawn_stdin_player(self.ffplay_path))
+
+	def _start(self, index):
+		self._stop(self.process)
+		song = self.playlist[index]
+		file_path, live = song[0], song[-1]
+		if live and live.process and live.process.poll() is None and self.index is None:
+			process = live.process	# Already playing the clip's stream
+		else:
+			if self.preloaded and self.preloaded[0] == index:
+				process = self.preloaded[1]
+				self.preloaded = None
+			else:
+				process = spawn_stdin_player(self.ffplay_path)
+			threading.Thread(target=_feed, args=(process, file_path), daemon=True).start()
+		self.index = index
+		self.process = process
+		self.waiting = False
+		self._watch(process)
+		if self.on_start:
+			self.on_start(song)
+		self._preload(index + 1)
+
+	def run(self):
+		if not self.playlist.wait_for(0):
+			return
+		import keyboard	# Imported on first use, only playback control needs it
+		self.playlist.listeners.append(lambda: self.events.put(('changed', None)))
+		hooks = [
+			keyboard.on_press_key('right', lambda e: self.events.put(('next', None))),
+			keyboard.on_press_key('left', lambda e: self.events.put(('previous', None))),
+		]
+		try:
+			self._start(0)	# Start the first song as soon as it is ready
+			while True:
+				event, process = self.events.get()
+				if event == 'next' and self.index < len(self.playlist) - 1:
+					self._start(self.index + 1)
+				elif event == 'previous' and self.index > 0:
+					self._start(self.index - 1)
+				elif event == 'finished' and process is self.process:
+					if self.index < len(self.playlist) - 1:
+						self._start(self.index + 1)
+					elif self.playlist.closed:
+						return
+					else:
+						self.waiting = True
+				elif event == 'changed':
+					if self.waiting and self.index < len(self.playlist) - 1:
+						self._start(self.index + 1)
+					elif self.waiting and self.playlist.closed:
+						return
+					else:
+						self._preload(self.index + 1)
+		finally:
+			for hook in hooks:
+				keyboard.unhook(hook)
+			self._stop(self.process)
+			if self.preloaded:
+				self._stop(self.preloaded[1])
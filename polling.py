@@ -0,0 +1,97 @@
+import random
+import time
+import asyncio
+
+# Seconds between polls for each clip status; generation spends most of its time in 'submitted'/'queued'
+DEFAULT_INTERVALS = {
+	'submitted': 10,
+	'queued': 10,
+	'streaming': 3,
+}
+# Statuses after which a clip is not polled any more; client.py and watcher.py use the same set
+FINAL_STATUSES = ('complete', 'error')
+
+class Poller:
+	def __init__(self, intervals=None, default_interval=5, deadline=600, backoff_base=2, backoff_max=60, jitter=0.2):
+		self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+		self.default_interval = default_interval
+		self.deadline = deadline
+		self.backoff_base = backoff_base
+		self.backoff_max = backoff_max
+		self.jitter = jitter
+		self.failures = 0
+		self.polls = 0
+		self.errors = 0
+		self.poll_times = []
+		self.started_at = None
+		self.last_status = None
+
+	def _jittered(self, delay):
+		return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+	def next_delay(self, status):
+		if self.failures:
+			# Exponential backoff while the proxy keeps failing
+			return self._jittered(min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1)))
+		return self._jittered(self.intervals.get(status, self.default_interval))
+
+	def run(self, check, stop_statuses=FINAL_STATUSES):
+		# check() returns (status, result); polls until the status is in stop_statuses and returns that result
+		end = self._start()
+		while True:
+			poll_start = time.monotonic()
+			try:
+				outcome = check()
+			except Exception as e:
+				outcome = e
+			done, value = self._handle(outcome, poll_start, stop_statuses, end)
+			if done:
+				return value
+			time.sleep(value)
+
+	async def run_async(self, check, stop_statuses=FINAL_STATUSES):
+		# Same as run() for a coroutine function check, waiting without blocking the event loop
+		end = self._start()
+		while True:
+			poll_start = time.monotonic()
+			try:
+				outcome = await check()
+			except Exception as e:
+				outcome = e
+			done, value = self._handle(outcome, poll_start, stop_statuses, end)
+			if done:
+				return value
+			await asyncio.sleep(value)
+
+	def _start(self):
+		self.started_at = time.monotonic()
+		return self.started_at + self.deadline
+
+	def _handle(self, outcome, poll_start, stop_statuses, end):
+		# outcome is check()'s (status, result) or the exception it raised.
+		# Returns (True, result) once finished, otherwise (False, seconds to wait before the next poll)
+		self.polls += 1
+		if isinstance(outcome, Exception):
+			self.errors += 1
+			self.failures += 1
+			status = self.last_status
+			print(f"Poll failed ({outcome}), retrying with backoff.")
+		else:
+			status, result = outcome
+			self.failures = 0
+			self.last_status = status
+			if status in stop_statuses:
+				self.poll_times.append(time.monotonic() - poll_start)
+				return True, result
+		self.poll_times.append(time.monotonic() - poll_start)
+
+		delay = self.next_delay(status)
+		if time.monotonic() + delay > end:
+			raise TimeoutError(f"Gave up after {self.deadline} seconds (last status: {self.last_status})")
+		return False, delay
+
+	def summary(self):
+		elapsed = time.monotonic() - self.started_at if self.started_at else 0
+		avg = sum(self.poll_times) / len(self.poll_times) if self.poll_times else 0
+		slowest = max(self.poll_times, default=0)
+		return f"{self.polls} polls ({self.errors} failed) over {elapsed:.1f}s, avg {avg * 1000:.0f}ms, max {slowest * 1000:.0f}ms per poll"
@@ -0,0 +1,139 @@
+# -*- coding:utf-8 -*-
+
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+
+class UpstreamError(Exception):
+    """An upstream failure, carrying the HTTP status the proxy should answer with."""
+
+    def __init__(self, status_code, detail, retry_after=None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class QueueFull(UpstreamError):
+    """Raised by the proxy's own rate limiter, as opposed to a 429 from the upstream."""
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # waiters queue on the lock, so requests leave in arrival order at `rate` per second
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call through after `reset_timeout`."""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def check(self):
+        """Fail fast while open, or while half-open and the trial call is out."""
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial is not None):
+            retry_after = self.reset_timeout - (time.monotonic() - self.opened_at)
+            raise UpstreamError(
+                503, "upstream is unavailable, failing fast", max(1, int(retry_after))
+            )
+        return state
+
+    def begin(self):
+        """Call right before sending; returns a trial handle when this call is the half-open trial."""
+        if self.check() != "half-open":
+            return None
+        self._trial = object()
+        return self._trial
+
+    def release(self, trial):
+        # a trial that ended without an outcome (cancelled, or no response to judge) frees its slot
+        if trial is not None and self._trial is trial:
+            self._trial = None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._trial = None
+
+
+class UpstreamPolicy:
+    def __init__(self, name, rate, burst, breaker_threshold, breaker_reset, max_wait):
+        self.name = name
+        self.limiter = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.max_wait = max_wait
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self.limiter.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            raise QueueFull(
+                429, f"too many queued {self.name} requests", int(self.max_wait)
+            )
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """Seconds to wait before the next attempt, or None when Retry-After asks for longer than `cap`."""
+    if retry_after is not None:
+        # retrying sooner than asked would be refused again; the caller hands Retry-After on instead
+        return retry_after if retry_after <= cap else None
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def proxy_status(upstream_status):
+    # client errors are passed through; upstream server errors become 502 Bad Gateway
+    if upstream_status >= 500:
+        return 502
+    return upstream_status
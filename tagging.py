@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import threading
+
+COVER_CACHE_DIR = os.path.join('songs', '.covers')
+
+_index_lock = threading.Lock()
+
+def _write_atomic(path, data):
+	tmp_path = f"{path}.{threading.get_ident()}.tmp"
+	with open(tmp_path, 'wb') as f:
+		f.write(data)
+	os.replace(tmp_path, path)
+
+def _load_index(cache_dir):
+	try:
+		with open(os.path.join(cache_dir, 'index.json'), 'r') as f:
+			return json.load(f)
+	except (FileNotFoundError, ValueError):
+		return {}
+
+def cached_cover(image_url, cache_dir=COVER_CACHE_DIR):
+	# Covers are stored under the SHA-256 of their bytes; index.json maps each URL to its digest
+	with _index_lock:
+		digest = _load_index(cache_dir).get(image_url)
+	if digest:
+		try:
+			with open(os.path.join(cache_dir, f"{digest}.jpg"), 'rb') as f:
+				print(f"Album art loaded from cache: {image_url}")
+				return f.read()
+		except FileNotFoundError:
+			pass
+	return None
+
+def store_cover(image_url, data, cache_dir=COVER_CACHE_DIR):
+	os.makedirs(cache_dir, exist_ok=True)
+	digest = hashlib.sha256(data).hexdigest()
+	blob_path = os.path.join(cache_dir, f"{digest}.jpg")
+	if not os.path.exists(blob_path):
+		_write_atomic(blob_path, data)
+	with _index_lock:
+		index = _load_index(cache_dir)
+		index[image_url] = digest
+		_write_atomic(os.path.join(cache_dir, 'index.json'), json.dumps(index).encode())
+
+def write_tags(mp3_file_path, title, lyrics, cover=None):
+	# Cover, title and lyrics are added in memory and the file is rewritten once
+	from mutagen.mp3 import MP3	# Imported on first use to keep startup fast
+	from mutagen.id3 import ID3, APIC, TIT2, USLT
+	audio = MP3(mp3_file_path, ID3=ID3)
+	if audio.tags is None:
+		audio.add_tags()
+	if cover:
+		audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc=u'Cover', data=cover))
+	clean_title = title.replace('-', ' ').replace('.mp3', '')  # Remove dashes and extension from title
+	audio.tags.add(TIT2(encoding=3, text=clean_title))
+	audio.tags.add(USLT(encoding=3, lang=u'eng', desc=u'lyrics', text=lyrics))
+	audio.save()
+	print(f"ID3 tags set for {mp3_file_path}")
@@ -1,10 +1,27 @@
+import asyncio
 import json
 import os
+import sqlite3
 import time
 
+import pytest
 import requests
+from aiohttp import web
 from requests import get as rget
 
+import cookie
+import feed
+import idempotency
+import utils
+from accounts import Account, AccountPool, AccountUnavailable
+from cache import FeedCache
+from fakeupstream import FakeSuno, make_jwt, start
+from feed import FeedCoalescer
+from idempotency import GenerateDeduplicator, IdempotencyConflict
+from polling import Poller
+from resilience import UpstreamPolicy
+from tokenstore import TokenStore
+
 
 def test_generate_music():
     data = {
@@ -58,14 +75,15 @@ def get_info(aid):
 
 
 def save_song(aid, output_path="output"):
-    start_time = time.time()
-    while True:
+    def check():
         audio_url, metadata = get_info(aid)
-        if audio_url:
-            break
-        elif time.time() - start_time > 90:
-            raise TimeoutError("Failed to get audio_url within 90 seconds")
-        time.sleep(30)
+        return ("complete" if audio_url else "submitted"), audio_url
+
+    poller = Poller(deadline=90)
+    try:
+        audio_url = poller.run(check)
+    except TimeoutError:
+        raise TimeoutError("Failed to get audio_url within 90 seconds")
     response = rget(audio_url, allow_redirects=False, stream=True)
     if response.status_code != 200:
         raise Exception("Could not download song")
@@ -78,3 +96,226 @@ def save_song(aid, output_path="output"):
             # If the chunk is not empty, write it to the file.
             if chunk:
                 output_file.write(chunk)
+
+
+def test_breaker_recovers_when_trial_call_needs_new_token(monkeypatch):
+    # the half-open trial gets a 401; after the token refresh the breaker must close, not fail fast forever
+    statuses = [500, 500, 401, 200, 200]
+
+    async def feed(request):
+        return web.json_response([], status=statuses.pop(0))
+
+    async def refresh(stale_token):
+        return "fresh"
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/api/feed/", feed)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(utils, "BASE_URL", f"http://127.0.0.1:{port}")
+        monkeypatch.setattr(utils, "UPSTREAM_RETRIES", 0)
+        monkeypatch.setitem(
+            utils.policies, "feed", UpstreamPolicy("feed", 1000, 1000, 2, 0.05, 1)
+        )
+        utils.set_token_refresher(refresh)
+        try:
+            for _ in range(2):
+                try:
+                    await utils.get_feed("a", "stale")
+                except utils.UpstreamError as e:
+                    assert e.status_code == 502
+            assert utils.policies["feed"].breaker.state == "open"
+            await asyncio.sleep(0.06)
+            assert await utils.get_feed("a", "stale") == []
+            assert await utils.get_feed("a", "fresh") == []
+            assert utils.policies["feed"].breaker.state == "closed"
+        finally:
+            utils.set_token_refresher(None)
+            await utils.close_session()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_only_account_is_not_ejected_by_clerk_outage(monkeypatch):
+    # a Clerk 5xx is transient: the next call must refresh again rather than find the pool empty
+    async def run():
+        fake = FakeSuno(latency=0)
+        runner, url = await start(fake)
+        monkeypatch.setattr(utils, "BASE_URL", url)
+        monkeypatch.setattr(cookie, "CLERK_URL", url)
+        pool = AccountPool([Account("a", "sa", "__client=x")])
+        pool.primary.credits_checked = time.monotonic()
+        data = {"gpt_description_prompt": "x"}
+        try:
+            fake.token_status = 502
+            with pytest.raises(AccountUnavailable):
+                await pool.generate(data)
+            assert not pool.primary.ejected
+            fake.token_status = 200
+            assert len(json.loads(await pool.generate(data))["clips"]) == 2
+        finally:
+            await utils.close_session()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_token_store_ignores_save_after_lease_passed(tmp_path):
+    # a refresher that outlived its lease must not overwrite the token of the process that took over
+    path = str(tmp_path / "tokens.db")
+    slow, other = TokenStore(path, lease_time=0.05), TokenStore(path, lease_time=0.05)
+    assert slow.acquire_lease("s")
+    time.sleep(0.06)
+    assert other.acquire_lease("s")
+    assert other.save("s", "new", "c=2", time.time() + 60, time.time())
+    assert not slow.save("s", "old", "c=1", time.time() + 60, time.time())
+    assert slow.load("s")[:2] == ("new", "c=2")
+
+
+def test_token_store_save_failure_keeps_token_and_frees_lease(monkeypatch, tmp_path):
+    # Clerk already answered: a store error must neither trigger a second Clerk call nor strand the lease
+    async def run():
+        fake = FakeSuno(latency=0)
+        runner, url = await start(fake)
+        monkeypatch.setattr(cookie, "CLERK_URL", url)
+        store = TokenStore(str(tmp_path / "tokens.db"))
+
+        def broken_save(*args):
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(store, "save", broken_save)
+        suno_cookie = cookie.SunoCookie()
+        suno_cookie.set_session_id("s")
+        suno_cookie.load_cookie("__client=x")
+        try:
+            token = await cookie.TokenManager(suno_cookie, store=store).get_token()
+            assert token and fake.calls["token"] == 1
+            assert TokenStore(store.path).acquire_lease("s")
+        finally:
+            await utils.close_session()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def _dedup_store(shared, tmp_path):
+    return TokenStore(str(tmp_path / "results.db")) if shared else None
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_idempotency_key_generates_once(monkeypatch, tmp_path, shared):
+    # concurrent requests with one key spend credits once; a different body under that key is refused
+    store = _dedup_store(shared, tmp_path)
+    monkeypatch.setattr(idempotency, "get_store", lambda: store)
+
+    async def run():
+        fake = FakeSuno()
+        runner, url = await start(fake)
+        monkeypatch.setattr(utils, "BASE_URL", url)
+        monkeypatch.setattr(cookie, "CLERK_URL", url)
+        pool = AccountPool([Account("a", "sa", "__client=x")])
+        pool.primary.credits_checked = time.monotonic()
+        dedup = GenerateDeduplicator()
+        data = {"gpt_description_prompt": "x"}
+        try:
+            results = await asyncio.gather(
+                *[
+                    dedup.run("description-mode", data, "k", lambda: pool.generate(data))
+                    for _ in range(5)
+                ]
+            )
+            assert fake.generations["sa"] == 1
+            assert len({body for body, _ in results}) == 1
+            assert sorted(replayed for _, replayed in results) == [False] + [True] * 4
+            with pytest.raises(IdempotencyConflict) as e:
+                other = {"gpt_description_prompt": "y"}
+                await dedup.run("description-mode", other, "k", lambda: pool.generate(other))
+            assert e.value.status_code == 422
+            assert fake.generations["sa"] == 1
+        finally:
+            await utils.close_session()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_idempotency_key_does_not_keep_failed_generation(monkeypatch, tmp_path, shared):
+    # a retry after a failed generation must generate, not replay the failure or wait on a dead claim
+    store = _dedup_store(shared, tmp_path)
+    monkeypatch.setattr(idempotency, "get_store", lambda: store)
+
+    async def run():
+        fake = FakeSuno(latency=0)
+        runner, url = await start(fake)
+        monkeypatch.setattr(utils, "BASE_URL", url)
+        monkeypatch.setattr(cookie, "CLERK_URL", url)
+        pool = AccountPool([Account("a", "sa", "__client=x")])
+        pool.primary.credits_checked = time.monotonic()
+        dedup = GenerateDeduplicator()
+        data = {"gpt_description_prompt": "x"}
+        try:
+            fake.token_status = 502
+            with pytest.raises(AccountUnavailable):
+                await dedup.run("description-mode", data, "k", lambda: pool.generate(data))
+            fake.token_status = 200
+            body, replayed = await asyncio.wait_for(
+                dedup.run("description-mode", data, "k", lambda: pool.generate(data)), 5
+            )
+            assert not replayed and len(json.loads(body)["clips"]) == 2
+            assert fake.generations["sa"] == 1
+        finally:
+            await utils.close_session()
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def test_feed_coalescer_splits_large_lookup(monkeypatch):
+    # 120 ids in one lookup go upstream as 50 + 50 + 20, never as one oversized ?ids= call
+    sizes = []
+
+    async def run():
+        fake = FakeSuno(latency=0)
+        runner, url = await start(fake)
+        monkeypatch.setattr(utils, "BASE_URL", url)
+
+        async def get_feed(ids, token):
+            sizes.append(len(ids.split(",")))
+            return await utils.get_feed(ids, token)
+
+        monkeypatch.setattr(feed, "get_feed", get_feed)
+        ids = [f"clip-{i}" for i in range(120)]
+        try:
+            clips = await FeedCoalescer(window=0.01, max_batch=50).get(ids, make_jwt(60, "s"))
+            assert clips == [None] * 120
+        finally:
+            await utils.close_session()
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert sorted(sizes) == [20, 50, 50]
+
+
+def test_feed_cache_keeps_complete_clips_and_expires_others():
+    cache = FeedCache(max_entries=3, ttl=0.05)
+    cache.put({"id": "done", "status": "complete"})
+    cache.put({"id": "busy", "status": "streaming"})
+    assert cache.get("busy")["status"] == "streaming"
+    time.sleep(0.06)
+    assert cache.get("done")["status"] == "complete"
+    assert cache.get("busy") is None
+
+    # least recently used goes first once the cache is full
+    cache.put({"id": "a", "status": "complete"})
+    cache.put({"id": "b", "status": "complete"})
+    cache.get("done")
+    cache.put({"id": "c", "status": "complete"})
+    assert cache.get("a") is None
+    assert cache.get("done") is not None
+    assert cache.stats()["evictions"] == 1
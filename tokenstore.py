@@ -0,0 +1,199 @@
+# -*- coding:utf-8 -*-
+
+import os
+import sqlite3
+import time
+import uuid
+
+# shared by every worker of `uvicorn main:app --workers N`; unset keeps state per process.
+# The file holds live session credentials, so keep it somewhere only the proxy's user can reach
+TOKEN_STORE = os.getenv("TOKEN_STORE", "")
+TOKEN_LEASE_TIME = float(os.getenv("TOKEN_LEASE_TIME", "15"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    session_id TEXT PRIMARY KEY,
+    token TEXT,
+    cookie TEXT,
+    expires_at REAL,
+    refreshed_at REAL,
+    lease_owner TEXT,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS owners (
+    item_id TEXT PRIMARY KEY,
+    account TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS owners_created ON owners (created);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    body BLOB,
+    claimed_at REAL NOT NULL,
+    expires_at REAL
+);
+"""
+
+
+class TokenStore:
+    """Session tokens and cookies in a SQLite file, with a lease so one process refreshes at a time.
+
+    It also holds clip owners and generate results, so every worker sees them.
+
+    Every method blocks on the database; call them through asyncio.to_thread.
+    """
+
+    def __init__(self, path, lease_time=TOKEN_LEASE_TIME):
+        self.path = path
+        self.lease_time = lease_time
+        self.owner_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # created owner-only before SQLite opens it; SQLite gives its -wal and -shm files the same mode
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        # one short-lived connection per call, so worker threads never share one
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def load(self, session_id):
+        """(token, cookie, expires_at, refreshed_at) last stored for the session, or None."""
+        with self._connect() as db:
+            return db.execute(
+                "SELECT token, cookie, expires_at, refreshed_at FROM tokens WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+
+    def acquire_lease(self, session_id):
+        """Become the session's refresher unless another process holds an unexpired lease."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "INSERT OR IGNORE INTO tokens (session_id) VALUES (?)", (session_id,)
+                )
+                acquired = db.execute(
+                    "UPDATE tokens SET lease_owner = ?, lease_until = ?"
+                    " WHERE session_id = ? AND (lease_until < ? OR lease_owner = ?)",
+                    (self.owner_id, now + self.lease_time, session_id, now, self.owner_id),
+                ).rowcount
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return bool(acquired)
+
+    def save(self, session_id, token, cookie, expires_at, refreshed_at):
+        """Publish a refreshed token and release the lease; False if the lease had passed to another process."""
+        with self._connect() as db:
+            return bool(
+                db.execute(
+                    "UPDATE tokens SET token = ?, cookie = ?, expires_at = ?, refreshed_at = ?,"
+                    " lease_owner = NULL, lease_until = 0 WHERE session_id = ? AND lease_owner = ?",
+                    (token, cookie, expires_at, refreshed_at, session_id, self.owner_id),
+                ).rowcount
+            )
+
+    def release_lease(self, session_id):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE tokens SET lease_owner = NULL, lease_until = 0"
+                " WHERE session_id = ? AND lease_owner = ?",
+                (session_id, self.owner_id),
+            )
+
+    def get_owners(self, item_ids):
+        """{item_id: account} for the given ids that have a recorded owner."""
+        marks = ",".join("?" * len(item_ids))
+        with self._connect() as db:
+            return dict(
+                db.execute(
+                    f"SELECT item_id, account FROM owners WHERE item_id IN ({marks})",
+                    list(item_ids),
+                )
+            )
+
+    def put_owners(self, item_ids, account, keep):
+        """Record which account created `item_ids`, keeping only the newest `keep` records."""
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO owners (item_id, account, created) VALUES (?, ?, ?)",
+                [(item_id, account, now) for item_id in item_ids],
+            )
+            db.execute(
+                "DELETE FROM owners WHERE created < ("
+                " SELECT created FROM owners ORDER BY created DESC LIMIT 1 OFFSET ?)",
+                (keep,),
+            )
+
+    def claim_result(self, key, fingerprint, pending_timeout):
+        """("done", body), ("pending", None), ("claimed", None) or ("conflict", None) for a generate result.
+
+        "claimed" means the caller is now the one generating it; a claim older
+        than `pending_timeout` was abandoned and may be taken over.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT fingerprint, body, claimed_at, expires_at FROM results WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and (
+                    (row[1] is not None and row[3] < now)
+                    or (row[1] is None and row[2] < now - pending_timeout)
+                ):
+                    row = None
+                if row is None:
+                    db.execute(
+                        "INSERT OR REPLACE INTO results (key, fingerprint, body, claimed_at)"
+                        " VALUES (?, ?, NULL, ?)",
+                        (key, fingerprint, now),
+                    )
+                    state = ("claimed", None)
+                elif row[0] != fingerprint:
+                    state = ("conflict", None)
+                elif row[1] is None:
+                    state = ("pending", None)
+                else:
+                    state = ("done", row[1])
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return state
+
+    def finish_result(self, key, body, expires_at, keep):
+        """Store the body for a claimed result, keeping at most `keep` unexpired results."""
+        with self._connect() as db:
+            db.execute(
+                "UPDATE results SET body = ?, expires_at = ? WHERE key = ?",
+                (body, expires_at, key),
+            )
+            db.execute(
+                "DELETE FROM results WHERE expires_at < ? OR key IN ("
+                " SELECT key FROM results WHERE body IS NOT NULL"
+                " ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (time.time(), keep),
+            )
+
+    def drop_result(self, key):
+        """Give up a claim whose generation failed, so a retry can run it again."""
+        with self._connect() as db:
+            db.execute("DELETE FROM results WHERE key = ? AND body IS NULL", (key,))
+
+
+_store = None
+
+
+def get_store():
+    """The shared store, or None when TOKEN_STORE is empty."""
+    global _store
+    if _store is None and TOKEN_STORE:
+        _store = TokenStore(TOKEN_STORE)
+    return _store
@@ -0,0 +1,257 @@
+# -*- coding:utf-8 -*-
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# fraction of traces whose records below WARNING are kept; warnings and errors always are
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TRACE_HEADER = "X-Trace-Id"
+TRACE_ID_RE = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+REDACTED = "[redacted]"
+SECRET_KEYS = {"authorization", "cookie", "set-cookie", "token", "jwt", "session_id", "api_key"}
+SECRET_PATTERNS = (
+    re.compile(r"(Bearer\s+)[^\s'\",]+", re.IGNORECASE),
+    re.compile(r"()eyJ[\w-]+\.[\w-]+\.[\w-]*"),
+    re.compile(r"((?:__client|__session|session_id)=)[^;\s'\",]+"),
+)
+
+_trace_id = ContextVar("trace_id", default=None)
+_spans = ContextVar("spans", default=None)
+
+
+def redact(value):
+    """Return `value` with bearer tokens, JWTs and session cookies masked."""
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if str(k).lower() in SECRET_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        for pattern in SECRET_PATTERNS:
+            value = pattern.sub(lambda m: m.group(1) + REDACTED, value)
+    return value
+
+
+class EventLogger(logging.LoggerAdapter):
+    """Takes an event name plus keyword fields: log.info("upstream", status=200)."""
+
+    def __init__(self, name):
+        super().__init__(logging.getLogger(name), {})
+
+    def process(self, msg, kwargs):
+        fields = {
+            k: kwargs.pop(k)
+            for k in list(kwargs)
+            if k not in ("exc_info", "stack_info", "stacklevel", "extra")
+        }
+        kwargs["extra"] = {"fields": fields}
+        return msg, kwargs
+
+
+def get_logger(name):
+    return EventLogger(f"suno.{name}")
+
+
+class TraceFilter(logging.Filter):
+    """Stamps records with the current trace and drops unsampled ones below WARNING."""
+
+    def __init__(self, sample_rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        if record.levelno >= logging.WARNING or self.sample_rate >= 1:
+            return True
+        # sampling by trace keeps or drops every record of a request together
+        if record.trace_id is None:
+            return random.random() < self.sample_rate
+        return zlib.crc32(record.trace_id.encode()) % 10000 < self.sample_rate * 10000
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        if record.trace_id:
+            entry["trace_id"] = record.trace_id
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(redact(entry), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = redact(getattr(record, "fields", {}))
+        fields = " ".join(f"{k}={v}" for k, v in fields.items())
+        line = f"{self.formatTime(record)} {record.levelname:<7} [{record.trace_id or '-'}] {record.getMessage()} {fields}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return redact(line)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; a full queue drops records instead of blocking."""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # formatting and redaction happen on the writer thread
+        return record
+
+
+_listener = None
+
+
+def start_logging(stream=None):
+    """Route the "suno" loggers through a queue drained by a background thread."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(TraceFilter())
+
+    logger = logging.getLogger("suno")
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers = [handler]
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def start_trace(trace_id=None):
+    """Bind a trace to the current context, keeping a well-formed incoming id."""
+    if not trace_id or not TRACE_ID_RE.fullmatch(trace_id):
+        trace_id = new_trace_id()
+    _trace_id.set(trace_id)
+    _spans.set([])
+    return trace_id
+
+
+log = get_logger("trace")
+
+
+@contextmanager
+def span(name, level=logging.DEBUG, **fields):
+    """Time a block, record it on the current trace and log it; the block may add fields."""
+    started = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        record_span(name, time.perf_counter() - started, level, **fields)
+
+
+def record_span(name, duration, level=logging.DEBUG, **fields):
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, duration))
+    log.log(level, name, duration_ms=round(duration * 1000, 2), **fields)
+
+
+def span_summary():
+    """Total milliseconds and count per span name on the current trace."""
+    summary = {}
+    for name, duration in _spans.get() or ():
+        total, count = summary.get(name, (0.0, 0))
+        summary[name] = (total + duration, count + 1)
+    return {name: (round(total * 1000, 2), count) for name, (total, count) in summary.items()}
+
+
+def server_timing():
+    return ", ".join(
+        f"{name};dur={total}" for name, (total, count) in span_summary().items()
+    )
+
+
+class TraceMiddleware:
+    """ASGI middleware binding each request to a trace and logging where its time went."""
+
+    def __init__(self, app):
+        self.app = app
+        self.log = get_logger("http")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope["headers"]).get(TRACE_HEADER.lower().encode(), b"")
+        trace_id = start_trace(incoming.decode("latin-1"))
+        status_code = 500 if scope["type"] == "http" else None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((TRACE_HEADER.lower().encode(), trace_id.encode()))
+                timing = server_timing()
+                if timing:
+                    headers.append((b"server-timing", timing.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.log.log(
+                logging.WARNING if status_code and status_code >= 500 else logging.INFO,
+                "request",
+                method=scope.get("method", "WEBSOCKET"),
+                route=route,
+                status=status_code,
+                duration_ms=round((time.perf_counter() - start) * 1000, 2),
+                spans=span_summary(),
+            )
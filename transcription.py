@@ -0,0 +1,90 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from capture import FlacEncoder
+
+class TranscriptionBackend(ABC):
+	# Turns one encoded audio segment into text; a backend without transcribe() fails when it is created, not in a worker thread
+	@abstractmethod
+	def transcribe(self, audio_data, filename):
+		pass
+
+class OpenAIBackend(TranscriptionBackend):
+	def __init__(self, model="whisper-1", language="en"):
+		import openai
+		openai.api_key = os.getenv("OPENAI_API_KEY")
+		self.openai = openai
+		self.model = model
+		self.language = language
+
+	def transcribe(self, audio_data, filename):
+		transcription_response = self.openai.audio.transcriptions.create(
+			model=self.model,
+			file=(filename, audio_data),
+			language=self.language
+		)
+		if hasattr(transcription_response, 'text'):
+			return transcription_response.text
+		return transcription_response['choices'][0]['text']
+
+class OfflineBackend(TranscriptionBackend):
+	# Needs no network: returns a placeholder per segment after an optional simulated latency
+	def __init__(self, latency=0.0):
+		self.latency = latency
+
+	def transcribe(self, audio_data, filename):
+		time.sleep(self.latency)
+		return f"[{filename}: {len(audio_data)} bytes]"
+
+BACKENDS = {
+	'openai': OpenAIBackend,
+	'offline': OfflineBackend,
+}
+
+class SegmentedTranscriber:
+	# Encoder that cuts the recording into segments at pauses and transcribes each one in the background,
+	# so only the last segment is still pending when recording stops
+	def __init__(self, backend, rate, channels, chunk_seconds, min_segment=5.0, max_segment=30.0, workers=2):
+		self.backend = backend
+		self.rate = rate
+		self.channels = channels
+		self.chunk_seconds = chunk_seconds
+		self.min_segment = min_segment
+		self.max_segment = max_segment
+		self.executor = ThreadPoolExecutor(max_workers=workers)
+		self.futures = []
+		self.encoder = None
+		self.segment_seconds = 0.0
+
+	def write(self, pcm):
+		if self.encoder is None:
+			self.encoder = FlacEncoder(self.rate, self.channels)
+		self.encoder.write(pcm)
+		self.segment_seconds += self.chunk_seconds
+		if self.segment_seconds >= self.max_segment:
+			self.cut()
+
+	def pause(self):
+		# Called at a pause in speech, which is a clean place to end a segment
+		if self.segment_seconds >= self.min_segment:
+			self.cut()
+
+	def cut(self):
+		if self.encoder is None:
+			return
+		audio_data = self.encoder.finish()
+		filename = f"segment-{len(self.futures) + 1}.flac"
+		self.futures.append(self.executor.submit(self.backend.transcribe, audio_data, filename))
+		self.encoder = None
+		self.segment_seconds = 0.0
+
+	def finish(self):
+		self.cut()
+		started = time.monotonic()
+		try:
+			texts = [future.result().strip() for future in self.futures]
+		finally:
+			self.executor.shutdown()
+		print(f"Transcribed {len(texts)} segment(s), waited {time.monotonic() - started:.2f}s after recording stopped")
+		return " ".join(text for text in texts if text)
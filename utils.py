@@ -1,10 +1,22 @@
-import json
+import asyncio
+import logging
 import os
 import time
 
 import aiohttp
 from dotenv import load_dotenv
 
+import codec
+from metrics import upstream_in_flight, upstream_latency, upstream_requests
+from resilience import (
+    UpstreamError,
+    UpstreamPolicy,
+    backoff_delay,
+    parse_retry_after,
+    proxy_status,
+)
+from tracing import get_logger, record_span, span
+
 load_dotenv()
 
 BASE_URL = os.getenv("BASE_URL")
@@ -16,48 +28,243 @@ COMMON_HEADERS = {
     "Origin": "https://suno.com",
 }
 
+UPSTREAM_LIMIT = int(os.getenv("UPSTREAM_LIMIT", "100"))
+UPSTREAM_LIMIT_PER_HOST = int(os.getenv("UPSTREAM_LIMIT_PER_HOST", "20"))
+UPSTREAM_KEEPALIVE_TIMEOUT = float(os.getenv("UPSTREAM_KEEPALIVE_TIMEOUT", "60"))
+UPSTREAM_DNS_TTL = int(os.getenv("UPSTREAM_DNS_TTL", "300"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "60"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "3"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "10"))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+
+# requests per second and burst size for each class of upstream endpoint
+RATE_LIMITS = {
+    "generate": (
+        float(os.getenv("RATE_LIMIT_GENERATE", "1")),
+        int(os.getenv("RATE_BURST_GENERATE", "5")),
+    ),
+    "feed": (
+        float(os.getenv("RATE_LIMIT_FEED", "10")),
+        int(os.getenv("RATE_BURST_FEED", "20")),
+    ),
+    "lyrics": (
+        float(os.getenv("RATE_LIMIT_LYRICS", "2")),
+        int(os.getenv("RATE_BURST_LYRICS", "5")),
+    ),
+    "billing": (
+        float(os.getenv("RATE_LIMIT_BILLING", "1")),
+        int(os.getenv("RATE_BURST_BILLING", "5")),
+    ),
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# a generation that may have reached the upstream is never retried, it would spend credits twice
+UNSAFE_RETRY_STATUSES = (429, 503)
+
+log = get_logger("upstream")
+
+policies = {
+    kind: UpstreamPolicy(
+        kind, rate, burst, BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT, RATE_LIMIT_MAX_WAIT
+    )
+    for kind, (rate, burst) in RATE_LIMITS.items()
+}
+
+_session = None
+_token_refresher = None
+
+
+async def init_session():
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=UPSTREAM_LIMIT,
+            limit_per_host=UPSTREAM_LIMIT_PER_HOST,
+            keepalive_timeout=UPSTREAM_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=UPSTREAM_DNS_TTL,
+            use_dns_cache=True,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
 
-async def fetch(url, headers=None, data=None, method="POST"):
+async def get_session():
+    if _session is None or _session.closed:
+        return await init_session()
+    return _session
+
+
+def set_token_refresher(refresher):
+    """Register a coroutine called with the rejected token when the upstream answers 401."""
+    global _token_refresher
+    _token_refresher = refresher
+
+
+async def fetch(
+    url,
+    headers=None,
+    data=None,
+    method="POST",
+    kind="feed",
+    raw=False,
+    retry_throttled=True,
+):
+    """Call the upstream; with `raw` the JSON body is returned as bytes without being parsed.
+
+    Without `retry_throttled` a 429 is raised at once, for callers that can move
+    the request to another account instead of waiting.
+    """
     if headers is None:
         headers = {}
     headers.update(COMMON_HEADERS)
     if data is not None:
-        data = json.dumps(data)
-
-    print(data, method, headers, url)
+        data = codec.dumps(data)
 
-    async with aiohttp.ClientSession() as session:
+    policy = policies[kind]
+    safe = method == "GET"
+    session = await get_session()
+    attempt = 0
+    refreshed = False
+    # the upstream just answered, so the retry with a fresh token skips the breaker
+    reauth = False
+    while True:
+        if not reauth:
+            policy.breaker.check()
+        with span("rate_limit_wait", kind=kind):
+            await policy.acquire()
+        trial = None if reauth else policy.breaker.begin()
+        reauth = False
+        upstream_in_flight.inc(kind)
+        started = time.perf_counter()
+        outcome = "error"
         try:
             async with session.request(
                 method=method, url=url, data=data, headers=headers
             ) as resp:
-                return await resp.json()
-        except Exception as e:
-            return f"An error occurred: {e}"
+                outcome = resp.status
+                if resp.status < 500:
+                    policy.breaker.record_success()
+                if resp.status == 401 and not refreshed and _can_refresh(headers):
+                    refreshed = reauth = True
+                    stale_token = headers["Authorization"][len("Bearer ") :]
+                    headers["Authorization"] = (
+                        f"Bearer {await _token_refresher(stale_token)}"
+                    )
+                    continue
+                if resp.status < 400:
+                    body = await resp.read()
+                    return body if raw else codec.loads(body)
+
+                error = UpstreamError(
+                    proxy_status(resp.status),
+                    await resp.text() or resp.reason,
+                    parse_retry_after(resp.headers.get("Retry-After")),
+                )
+                if resp.status >= 500:
+                    policy.breaker.record_failure()
+                retryable = resp.status in (
+                    RETRY_STATUSES if safe else UNSAFE_RETRY_STATUSES
+                ) and (retry_throttled or resp.status != 429)
+        except asyncio.TimeoutError:
+            policy.breaker.record_failure()
+            error = UpstreamError(504, "upstream timed out")
+            retryable = safe
+        except aiohttp.ClientConnectorError as e:
+            # the request never reached the upstream, so even a generation is safe to retry
+            policy.breaker.record_failure()
+            error = UpstreamError(502, f"cannot reach upstream: {e}")
+            retryable = True
+        except (aiohttp.ClientError, ValueError) as e:
+            policy.breaker.record_failure()
+            error = UpstreamError(502, f"bad upstream response: {e}")
+            retryable = safe
+        finally:
+            policy.breaker.release(trial)
+            elapsed = time.perf_counter() - started
+            upstream_in_flight.dec(kind)
+            upstream_latency.observe(elapsed, kind)
+            upstream_requests.inc(kind, outcome)
+            record_span(
+                "upstream",
+                elapsed,
+                logging.INFO,
+                kind=kind,
+                method=method,
+                url=url,
+                attempt=attempt,
+                status=outcome,
+            )
+
+        attempt += 1
+        if not retryable or attempt > UPSTREAM_RETRIES:
+            raise error
+        delay = backoff_delay(
+            attempt, UPSTREAM_BACKOFF_BASE, UPSTREAM_BACKOFF_MAX, error.retry_after
+        )
+        if delay is None:
+            raise error
+        log.warning(
+            "upstream_retry",
+            kind=kind,
+            attempt=attempt,
+            status=error.status_code,
+            delay=round(delay, 2),
+        )
+        with span("backoff", kind=kind):
+            await asyncio.sleep(delay)
+
+
+def _can_refresh(headers):
+    return _token_refresher is not None and "Authorization" in headers
 
 
 async def get_feed(ids, token):
     headers = {"Authorization": f"Bearer {token}"}
     api_url = f"{BASE_URL}/api/feed/?ids={ids}"
-    response = await fetch(api_url, headers, method="GET")
+    response = await fetch(api_url, headers, method="GET", kind="feed")
     return response
 
 
-async def generate_music(data, token):
+async def get_credits(token):
+    headers = {"Authorization": f"Bearer {token}"}
+    api_url = f"{BASE_URL}/api/billing/info/"
+    return await fetch(api_url, headers, method="GET", kind="billing")
+
+
+async def generate_music(data, token, raw=False, retry_throttled=True):
     headers = {"Authorization": f"Bearer {token}"}
     api_url = f"{BASE_URL}/api/generate/v2/"
-    response = await fetch(api_url, headers, data)
+    response = await fetch(
+        api_url, headers, data, kind="generate", raw=raw, retry_throttled=retry_throttled
+    )
     return response
 
 
-async def generate_lyrics(prompt, token):
+async def generate_lyrics(prompt, token, raw=False, retry_throttled=True):
     headers = {"Authorization": f"Bearer {token}"}
     api_url = f"{BASE_URL}/api/generate/lyrics/"
     data = {"prompt": prompt}
-    return await fetch(api_url, headers, data)
+    return await fetch(
+        api_url, headers, data, kind="lyrics", raw=raw, retry_throttled=retry_throttled
+    )
 
 
-async def get_lyrics(lid, token):
+async def get_lyrics(lid, token, raw=False):
     headers = {"Authorization": f"Bearer {token}"}
     api_url = f"{BASE_URL}/api/generate/lyrics/{lid}"
-    return await fetch(api_url, headers, method="GET")
+    return await fetch(api_url, headers, method="GET", kind="lyrics", raw=raw)
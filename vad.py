@@ -0,0 +1,73 @@
+import array
+import math
+from collections import deque
+
+def rms(pcm):
+	samples = array.array('h', pcm)
+	if not samples:
+		return 0
+	return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+class EnergyVAD:
+	# Classifies 16-bit PCM chunks as speech or silence by their RMS energy
+	def __init__(self, threshold=500):
+		self.threshold = threshold
+
+	def is_speech(self, pcm):
+		return rms(pcm) >= self.threshold
+
+class SilenceTrimmer:
+	# Sits in front of an encoder: leading and trailing silence is dropped and pauses are capped,
+	# keeping `padding` chunks around speech so words are not clipped
+	def __init__(self, encoder, vad, chunk_seconds, padding=4, max_pause=1.0):
+		self.encoder = encoder
+		self.vad = vad
+		self.chunk_seconds = chunk_seconds
+		self.padding = padding
+		self.pending = deque(maxlen=max(padding, int(max_pause / chunk_seconds)))
+		self.heard_speech = False
+		self.silent_run = 0
+		self.dropped = 0
+		self.total = 0
+
+	@property
+	def trailing_silence(self):
+		# Seconds of silence since the last speech
+		return self.silent_run * self.chunk_seconds
+
+	def _flush(self, chunks):
+		for chunk in chunks:
+			self.encoder.write(chunk)
+		self.pending.clear()
+
+	def write(self, pcm):
+		self.total += 1
+		if not self.vad.is_speech(pcm):
+			self.silent_run += 1
+			if len(self.pending) == self.pending.maxlen:
+				self.dropped += 1
+			self.pending.append(pcm)
+			if self.heard_speech and self.silent_run == self.padding:
+				# The utterance ends with its trailing padding; a segmenting encoder may cut here
+				self._flush(self.pending)
+				if hasattr(self.encoder, 'pause'):
+					self.encoder.pause()
+			return
+
+		held = list(self.pending)
+		if not self.heard_speech:
+			# Only a short lead-in of the silence before the first word is kept
+			self.dropped += max(0, len(held) - self.padding)
+			held = held[-self.padding:] if self.padding else []
+		self._flush(held)
+		self.encoder.write(pcm)
+		self.heard_speech = True
+		self.silent_run = 0
+
+	def finish(self):
+		if self.heard_speech and self.silent_run < self.padding:
+			self._flush(self.pending)
+		self.dropped += len(self.pending)
+		self.pending.clear()
+		print(f"Trimmed {self.dropped * self.chunk_seconds:.1f}s of {self.total * self.chunk_seconds:.1f}s captured as silence")
+		return self.encoder.finish()
@@ -0,0 +1,103 @@
+# -*- coding:utf-8 -*-
+
+import asyncio
+import os
+import time
+
+from feed import fetch_clips
+from polling import FINAL_STATUSES
+from tracing import get_logger, start_trace
+
+FEED_WATCH_INTERVAL = float(os.getenv("FEED_WATCH_INTERVAL", "3"))
+FEED_WATCH_TIMEOUT = float(os.getenv("FEED_WATCH_TIMEOUT", "900"))
+
+log = get_logger("watcher")
+
+_watchers = {}
+
+
+class ClipWatcher:
+    """Polls one set of clips on behalf of every subscriber and pushes changes to them."""
+
+    def __init__(self, ids, interval=FEED_WATCH_INTERVAL, timeout=FEED_WATCH_TIMEOUT):
+        self.ids = ids
+        self.interval = interval
+        self.timeout = timeout
+        self.subscribers = set()
+        self.clips = {}
+        self.done = False
+        self._task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        # late subscribers start from the latest known state
+        for clip in self.clips.values():
+            queue.put_nowait(("clip", clip))
+        self.subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _publish(self, event):
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def _finished(self):
+        return len(self.clips) == len(self.ids) and all(
+            clip.get("status") in FINAL_STATUSES for clip in self.clips.values()
+        )
+
+    async def _run(self):
+        # the watcher outlives the request that started it, so it gets a trace of its own
+        start_trace()
+        log.info("watch_start", ids=self.ids)
+        deadline = time.monotonic() + self.timeout
+        try:
+            while self.subscribers:
+                try:
+                    clips = await fetch_clips(self.ids)
+                except Exception as e:
+                    self._publish(("error", {"detail": str(e)}))
+                else:
+                    for clip in clips:
+                        last = self.clips.get(clip["id"])
+                        if last is None or (last.get("status"), last.get("audio_url")) != (
+                            clip.get("status"),
+                            clip.get("audio_url"),
+                        ):
+                            self.clips[clip["id"]] = clip
+                            self._publish(("clip", clip))
+                    if self._finished():
+                        self._publish(("done", {"ids": self.ids}))
+                        break
+
+                if time.monotonic() >= deadline:
+                    self._publish(("timeout", {"ids": self.ids}))
+                    break
+                await asyncio.sleep(self.interval)
+        finally:
+            self.done = True
+            log.info("watch_end", ids=self.ids, clips=len(self.clips))
+            self._publish(None)
+            if _watchers.get(tuple(self.ids)) is self:
+                del _watchers[tuple(self.ids)]
+
+
+async def watch(ids):
+    """Yield (event, data) pairs for the given clips until they all finish."""
+    key = tuple(sorted(set(ids)))
+    watcher = _watchers.get(key)
+    if watcher is None:
+        watcher = _watchers[key] = ClipWatcher(list(key))
+    queue = watcher.subscribe()
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                return
+            yield event
+    finally:
+        watcher.unsubscribe(queue)